@@ -0,0 +1,79 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from .models import UserModel
+from metrics import register_stats
+
+
+PRINCIPAL_CACHE_SIZE = int(os.environ.get("PRINCIPAL_CACHE_SIZE", 4096))
+PRINCIPAL_CACHE_TTL = float(os.environ.get("PRINCIPAL_CACHE_TTL", 60))
+
+
+class PrincipalCache:
+    """
+        in-process LRU of authenticated users keyed by their access token.
+        entries expire after `ttl` seconds or when the token itself expires,
+        whichever comes first.
+    """
+
+    def __init__(self, maxsize: int = PRINCIPAL_CACHE_SIZE, ttl: float = PRINCIPAL_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, token: str) -> Optional[UserModel]:
+        entry = self._entries.get(token)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, user = entry
+        if expires_at <= time.monotonic():
+            del self._entries[token]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(token)
+        self.hits += 1
+        return user
+
+    def set(self, token: str, user: UserModel, token_exp: Optional[float] = None):
+        expires_at = time.monotonic() + self.ttl
+        if token_exp is not None:
+            expires_at = min(expires_at, time.monotonic() + (token_exp - time.time()))
+
+        self._entries[token] = (expires_at, user)
+        self._entries.move_to_end(token)
+
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, user_id: str = None, email: str = None):
+        # drop every token held by the user, called whenever the user document changes
+        for token, (_, user) in list(self._entries.items()):
+            if (user_id and user.id == str(user_id)) or (email and user.email == email):
+                del self._entries[token]
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+        }
+
+
+principal_cache = PrincipalCache()
+
+register_stats("principal_cache", "Authenticated user cache counters.", principal_cache.stats)
@@ -9,4 +9,26 @@ contactus_exception = HTTPException(
 support_exception = HTTPException(
     status_code=status.HTTP_400_BAD_REQUEST,
     detail="unable to create support object"
-)
\ No newline at end of file
+)
+
+password_service_busy_exception = HTTPException(
+    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+    detail="too many requests in progress, please retry shortly",
+    headers={"Retry-After": "1"},
+)
+
+picture_too_large_exception = HTTPException(
+    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+    detail="picture is too large"
+)
+
+invalid_picture_exception = HTTPException(
+    status_code=status.HTTP_400_BAD_REQUEST,
+    detail="upload a valid image in the picture field"
+)
+
+picture_service_busy_exception = HTTPException(
+    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+    detail="too many uploads in progress, please retry shortly",
+    headers={"Retry-After": "2"},
+)
@@ -0,0 +1,77 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from passlib.context import CryptContext
+
+from .exceptions import password_service_busy_exception
+from metrics import register_stats
+
+
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", 12))
+HASH_WORKERS = int(os.environ.get("HASH_WORKERS", os.cpu_count() or 2))
+# calls allowed to wait for a worker before new ones are shed with a 503
+HASH_QUEUE_LIMIT = int(os.environ.get("HASH_QUEUE_LIMIT", 64))
+
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+# bcrypt releases the GIL while hashing, so threads keep the event loop free
+_executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="bcrypt")
+_in_flight = 0
+
+hash_stats = {
+    "calls": 0,
+    "rejected": 0,
+    "hash_seconds_total": 0.0,
+    "hash_seconds_max": 0.0,
+    "queue_wait_seconds_total": 0.0,
+    "queue_wait_seconds_max": 0.0,
+}
+
+
+register_stats("password_hashing", "Password hashing calls, latency and queue wait.", lambda: hash_stats)
+
+
+def _record(queued_at: float, started_at: float, finished_at: float):
+    wait = started_at - queued_at
+    took = finished_at - started_at
+
+    hash_stats["calls"] += 1
+    hash_stats["hash_seconds_total"] += took
+    hash_stats["hash_seconds_max"] = max(hash_stats["hash_seconds_max"], took)
+    hash_stats["queue_wait_seconds_total"] += wait
+    hash_stats["queue_wait_seconds_max"] = max(hash_stats["queue_wait_seconds_max"], wait)
+
+
+async def _run(func, *args):
+    global _in_flight
+
+    if _in_flight >= HASH_WORKERS + HASH_QUEUE_LIMIT:
+        hash_stats["rejected"] += 1
+        raise password_service_busy_exception
+
+    queued_at = time.perf_counter()
+
+    def timed():
+        started_at = time.perf_counter()
+        result = func(*args)
+        return result, started_at, time.perf_counter()
+
+    _in_flight += 1
+    try:
+        result, started_at, finished_at = await asyncio.get_running_loop().run_in_executor(_executor, timed)
+    finally:
+        _in_flight -= 1
+
+    _record(queued_at, started_at, finished_at)
+    return result
+
+
+async def get_password_hash_async(password: str) -> str:
+    return await _run(pwd_context.hash, password)
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await _run(pwd_context.verify, plain_password, hashed_password)
@@ -0,0 +1,44 @@
+"""
+    image work for profile pictures. runs in worker processes, so this module
+    must stay importable without the app (no database, no settings).
+"""
+import hashlib
+from io import BytesIO
+from typing import Tuple
+
+from PIL import Image, ImageOps
+
+
+# refuse anything that would decode to more than ~40 megapixels
+Image.MAX_IMAGE_PIXELS = 40_000_000
+
+OUTPUT_FORMAT = "WEBP"
+OUTPUT_QUALITY = 85
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _encode(image: Image.Image, size: int) -> bytes:
+    resized = image.copy()
+    resized.thumbnail((size, size), Image.LANCZOS)
+    out = BytesIO()
+    resized.save(out, OUTPUT_FORMAT, quality=OUTPUT_QUALITY)
+    return out.getvalue()
+
+
+def process_picture(data: bytes, size: int, thumbnail_size: int) -> Tuple[bytes, bytes]:
+    """
+        decode an uploaded image, apply its EXIF orientation and re-encode it
+        as a bounded picture and a thumbnail. raises ValueError for anything
+        that isn't a decodable image.
+    """
+    try:
+        with Image.open(BytesIO(data)) as image:
+            image = ImageOps.exif_transpose(image)
+            image = image.convert("RGBA" if image.mode in ("RGBA", "LA", "P") else "RGB")
+    except (OSError, Image.DecompressionBombError) as err:
+        raise ValueError(str(err))
+
+    return _encode(image, size), _encode(image, thumbnail_size)
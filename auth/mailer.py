@@ -0,0 +1,212 @@
+import asyncio
+import os
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+
+import aiosmtplib
+from pymongo import ASCENDING, ReturnDocument
+
+from database import db as mongoDB
+from metrics import register_stats
+
+
+MAIL_SERVER = os.environ.get("MAIL_SERVER", "smtp-relay.gmail.com")
+MAIL_PORT = int(os.environ.get("MAIL_PORT", 587))
+# implicit TLS (port 465); otherwise STARTTLS is used when the server offers it
+MAIL_USE_TLS = os.environ.get("MAIL_USE_TLS", "false").lower() == "true"
+MAIL_WORKERS = int(os.environ.get("MAIL_WORKERS", 2))
+MAIL_BATCH_SIZE = int(os.environ.get("MAIL_BATCH_SIZE", 50))
+MAIL_MAX_ATTEMPTS = int(os.environ.get("MAIL_MAX_ATTEMPTS", 5))
+MAIL_IDLE_TIMEOUT = float(os.environ.get("MAIL_IDLE_TIMEOUT", 60))
+# sent and failed messages are deleted this long after they finish, see schema.INDEXES
+MAIL_RETENTION_DAYS = float(os.environ.get("MAIL_RETENTION_DAYS", 7))
+
+OUTBOX = "mail_outbox"
+POLL_INTERVAL = 5
+LEASE = timedelta(minutes=5)
+BACKOFF_BASE = 30
+BACKOFF_MAX = 60 * 60
+
+
+def build_message(to: str, subject: str, body: str, html: bool = True) -> EmailMessage:
+    msg = EmailMessage()
+    msg["From"] = os.environ["MAIL_USER"]
+    msg["To"] = to
+    msg["Subject"] = subject
+    msg.set_content(body, subtype="html" if html else "plain")
+    return msg
+
+
+def smtp_client() -> aiosmtplib.SMTP:
+    # aiosmtplib logs in on connect when credentials are given
+    password = os.environ.get("MAIL_PASSWORD")
+    return aiosmtplib.SMTP(
+        hostname=MAIL_SERVER,
+        port=MAIL_PORT,
+        username=os.environ.get("MAIL_USER") if password else None,
+        password=password or None,
+        use_tls=MAIL_USE_TLS,
+        timeout=30,
+    )
+
+
+class MailDispatcher:
+    """
+        delivers mail queued in the mail_outbox collection from background
+        workers. each worker keeps one SMTP connection open and sends a batch of
+        due messages over it; failed messages are retried with exponential
+        backoff and given up on after MAIL_MAX_ATTEMPTS. a sent message
+        loses its body, which can hold reset and verification tokens.
+    """
+
+    def __init__(self, workers: int = MAIL_WORKERS, batch_size: int = MAIL_BATCH_SIZE):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.stats = {"sent": 0, "retried": 0, "failed": 0, "connections": 0}
+
+        self._wakeup = asyncio.Event()
+        self._tasks = []
+        self._stopping = False
+
+    async def start(self):
+        self._stopping = False
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        self._stopping = True
+        self._wakeup.set()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self):
+        self._wakeup.set()
+
+    async def enqueue(self, to: str, subject: str, body: str, html: bool = True):
+        now = datetime.utcnow()
+        await mongoDB[OUTBOX].insert_one({
+            "to": to,
+            "subject": subject,
+            "body": body,
+            "html": html,
+            "status": "pending",
+            "attempts": 0,
+            "created_at": now,
+            "next_attempt_at": now,
+        })
+        self.notify()
+
+    async def _claim(self):
+        now = datetime.utcnow()
+        return await mongoDB[OUTBOX].find_one_and_update(
+            {"$or": [
+                {"status": "pending", "next_attempt_at": {"$lte": now}},
+                # a worker died mid-send, its lease has run out
+                {"status": "sending", "lease_until": {"$lte": now}},
+            ]},
+            {"$set": {"status": "sending", "lease_until": now + LEASE}},
+            sort=[("next_attempt_at", ASCENDING)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def _connect(self, smtp: aiosmtplib.SMTP = None) -> aiosmtplib.SMTP:
+        if smtp is not None and smtp.is_connected:
+            return smtp
+
+        smtp = smtp_client()
+        await smtp.connect()
+        self.stats["connections"] += 1
+        return smtp
+
+    async def deliver(self, smtp: aiosmtplib.SMTP, mail: dict) -> aiosmtplib.SMTP:
+        msg = build_message(mail["to"], mail["subject"], mail["body"], mail.get("html", True))
+        try:
+            smtp = await self._connect(smtp)
+            await smtp.send_message(msg)
+        except aiosmtplib.SMTPServerDisconnected:
+            # the server dropped an idle connection, reconnect once
+            smtp = await self._connect(None)
+            await smtp.send_message(msg)
+        return smtp
+
+    async def _mark_sent(self, mail: dict):
+        await mongoDB[OUTBOX].update_one(
+            {"_id": mail["_id"]},
+            {"$set": {"status": "sent", "sent_at": datetime.utcnow()}, "$unset": {"lease_until": "", "body": ""}},
+        )
+        self.stats["sent"] += 1
+
+    async def _mark_failed(self, mail: dict, err: Exception):
+        attempts = mail.get("attempts", 0) + 1
+        update = {"attempts": attempts, "last_error": str(err)}
+
+        if attempts >= MAIL_MAX_ATTEMPTS:
+            update["status"] = "failed"
+            update["failed_at"] = datetime.utcnow()
+            self.stats["failed"] += 1
+        else:
+            update["status"] = "pending"
+            update["next_attempt_at"] = datetime.utcnow() + timedelta(seconds=min(BACKOFF_BASE * 2 ** attempts, BACKOFF_MAX))
+            self.stats["retried"] += 1
+
+        await mongoDB[OUTBOX].update_one({"_id": mail["_id"]}, {"$set": update, "$unset": {"lease_until": ""}})
+
+    async def _worker(self):
+        smtp = None
+        idle_since = asyncio.get_running_loop().time()
+
+        while not self._stopping:
+            try:
+                batch = []
+                while len(batch) < self.batch_size:
+                    mail = await self._claim()
+                    if mail is None:
+                        break
+                    batch.append(mail)
+
+                if not batch:
+                    if smtp is not None and asyncio.get_running_loop().time() - idle_since > MAIL_IDLE_TIMEOUT:
+                        await self._close(smtp)
+                        smtp = None
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), POLL_INTERVAL)
+                    except asyncio.TimeoutError:
+                        pass
+                    self._wakeup.clear()
+                    continue
+
+                for mail in batch:
+                    try:
+                        smtp = await self.deliver(smtp, mail)
+                        await self._mark_sent(mail)
+                    except (aiosmtplib.SMTPException, OSError) as err:
+                        print(err, )
+                        if smtp is not None:
+                            smtp.close()
+                        smtp = None
+                        await self._mark_failed(mail, err)
+                idle_since = asyncio.get_running_loop().time()
+            except asyncio.CancelledError:
+                break
+            except Exception as err:
+                print(err, )
+                await asyncio.sleep(POLL_INTERVAL)
+
+        if smtp is not None:
+            await self._close(smtp)
+
+    async def _close(self, smtp: aiosmtplib.SMTP):
+        try:
+            await smtp.quit()
+        except Exception:
+            smtp.close()
+
+
+mail_dispatcher = MailDispatcher()
+
+register_stats("mail_dispatcher", "Outbound mail delivery counters.", lambda: mail_dispatcher.stats)
+
+
+async def enqueue_mail(to: str, subject: str, body: str, html: bool = True):
+    await mail_dispatcher.enqueue(to=to, subject=subject, body=body, html=html)
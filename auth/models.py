@@ -11,6 +11,7 @@ class UserModel(BaseModel):
     date_of_birth: Optional[date] = Field(None)
     about: Optional[str] = Field(default="")
     picture: Optional[AnyUrl] = Field(None)
+    picture_thumbnail: Optional[AnyUrl] = Field(None)
     password: str = Field(...)
     is_active: bool = False
     created_at: datetime = Field(None)
@@ -0,0 +1,211 @@
+"""
+    profile picture uploads: the multipart body is streamed with a hard size
+    cap, identical images are deduplicated by content hash, decoding and
+    resizing run in a process pool and the storage upload runs in a thread,
+    so nothing here blocks the event loop.
+"""
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+
+import cloudinary.uploader
+from fastapi import Request
+from starlette.datastructures import UploadFile
+from starlette.formparsers import MultiPartException, MultiPartParser
+
+from database import db as mongoDB
+from metrics import register_stats
+from .exceptions import invalid_picture_exception, picture_service_busy_exception, picture_too_large_exception
+from .imaging import content_hash, process_picture
+
+
+PICTURE_MAX_BYTES = int(os.environ.get("PICTURE_MAX_BYTES", 5 * 1024 * 1024))
+PICTURE_SIZE = int(os.environ.get("PICTURE_SIZE", 512))
+PICTURE_THUMBNAIL_SIZE = int(os.environ.get("PICTURE_THUMBNAIL_SIZE", 128))
+PICTURE_WORKERS = int(os.environ.get("PICTURE_WORKERS", 2))
+PICTURE_QUEUE_LIMIT = int(os.environ.get("PICTURE_QUEUE_LIMIT", 16))
+# cloudinary or local, local writes under PICTURE_LOCAL_DIR and is served from /media
+PICTURE_STORAGE = os.environ.get("PICTURE_STORAGE", "cloudinary")
+PICTURE_LOCAL_DIR = os.environ.get("PICTURE_LOCAL_DIR", "media")
+PICTURE_LOCAL_URL = os.environ.get("PICTURE_LOCAL_URL", "http://localhost:8000/media")
+
+# room for the multipart boundaries and headers around the file itself
+MULTIPART_OVERHEAD = 16 * 1024
+
+# documented request body, the handler parses it itself to enforce the cap while streaming
+UPLOAD_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "properties": {"picture": {"type": "string", "format": "binary"}},
+                    "required": ["picture"],
+                }
+            }
+        },
+    }
+}
+
+
+class CloudinaryStorage:
+
+    async def save(self, key: str, data: bytes) -> str:
+        result = await asyncio.to_thread(
+            cloudinary.uploader.upload, data, public_id=f"profile/{key}", overwrite=False, resource_type="image",
+        )
+        return result["secure_url"]
+
+
+class LocalStorage:
+
+    def __init__(self, root: str = PICTURE_LOCAL_DIR, base_url: str = PICTURE_LOCAL_URL):
+        self.root = root
+        self.base_url = base_url.rstrip("/")
+
+    def _write(self, name: str, data: bytes):
+        os.makedirs(self.root, exist_ok=True)
+        path = os.path.join(self.root, name)
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+
+    async def save(self, key: str, data: bytes) -> str:
+        name = f"{key}.webp"
+        await asyncio.to_thread(self._write, name, data)
+        return f"{self.base_url}/{name}"
+
+
+STORAGES = {"cloudinary": CloudinaryStorage, "local": LocalStorage}
+
+picture_storage = STORAGES[PICTURE_STORAGE]()
+
+_executor = None
+_in_flight = 0
+
+picture_stats = {
+    "uploads": 0,
+    "deduplicated": 0,
+    "rejected": 0,
+    "invalid": 0,
+    "process_seconds_total": 0.0,
+    "store_seconds_total": 0.0,
+}
+
+register_stats("profile_pictures", "Profile picture uploads, dedupes and processing time.", lambda: picture_stats)
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    # created on first use, inside the worker; spawn keeps the children clear of the parent's threads
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=PICTURE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+
+def shutdown_pictures():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+async def _capped(stream, limit: int):
+    received = 0
+    async for chunk in stream:
+        received += len(chunk)
+        if received > limit:
+            picture_stats["rejected"] += 1
+            raise picture_too_large_exception
+        yield chunk
+
+
+async def read_picture(request: Request, field: str = "picture") -> bytes:
+    """
+        read the uploaded file from a multipart request, giving up as soon as
+        the body passes PICTURE_MAX_BYTES instead of spooling all of it first.
+    """
+    limit = PICTURE_MAX_BYTES + MULTIPART_OVERHEAD
+    length = request.headers.get("content-length", "")
+    if length.isdigit() and int(length) > limit:
+        picture_stats["rejected"] += 1
+        raise picture_too_large_exception
+    if not request.headers.get("content-type", "").startswith("multipart/form-data"):
+        raise invalid_picture_exception
+
+    try:
+        form = await MultiPartParser(request.headers, _capped(request.stream(), limit), max_files=1, max_fields=4).parse()
+    except MultiPartException as err:
+        # a missing boundary, a malformed part or too many files/fields
+        print(err, )
+        raise invalid_picture_exception
+    try:
+        picture = form.get(field)
+        if not isinstance(picture, UploadFile):
+            raise invalid_picture_exception
+        data = await picture.read()
+    finally:
+        await form.close()
+
+    if len(data) > PICTURE_MAX_BYTES:
+        picture_stats["rejected"] += 1
+        raise picture_too_large_exception
+    return data
+
+
+async def _process(data: bytes):
+    global _in_flight
+
+    if _in_flight >= PICTURE_WORKERS + PICTURE_QUEUE_LIMIT:
+        picture_stats["rejected"] += 1
+        raise picture_service_busy_exception
+
+    _in_flight += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(
+            _get_executor(), process_picture, data, PICTURE_SIZE, PICTURE_THUMBNAIL_SIZE,
+        )
+    except ValueError:
+        picture_stats["invalid"] += 1
+        raise invalid_picture_exception
+    except BrokenProcessPool:
+        # a worker died (most likely out of memory), start a fresh pool for the next upload
+        shutdown_pictures()
+        raise
+    finally:
+        _in_flight -= 1
+
+
+async def store_picture(data: bytes) -> dict:
+    """
+        return the stored picture for these bytes, processing and uploading
+        it only the first time its content hash is seen.
+    """
+    picture_stats["uploads"] += 1
+    digest = await asyncio.to_thread(content_hash, data)
+
+    stored = await mongoDB["pictures"].find_one({"_id": digest})
+    if stored:
+        picture_stats["deduplicated"] += 1
+        return stored
+
+    started = time.perf_counter()
+    picture, thumbnail = await _process(data)
+    processed = time.perf_counter()
+
+    url, thumbnail_url = await asyncio.gather(
+        picture_storage.save(digest, picture),
+        picture_storage.save(f"{digest}_thumb", thumbnail),
+    )
+    picture_stats["process_seconds_total"] += processed - started
+    picture_stats["store_seconds_total"] += time.perf_counter() - processed
+
+    stored = {"_id": digest, "url": url, "thumbnail_url": thumbnail_url, "bytes": len(data), "created_at": datetime.now()}
+    # two identical uploads racing both end up pointing at the first record
+    await mongoDB["pictures"].update_one({"_id": digest}, {"$setOnInsert": stored}, upsert=True)
+    return await mongoDB["pictures"].find_one({"_id": digest})
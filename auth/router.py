@@ -3,25 +3,29 @@ from typing import Annotated
 from bson import ObjectId
 import os
 
-from fastapi import APIRouter, Depends, HTTPException, status, Query, UploadFile, File
-from fastapi.responses import JSONResponse, HTMLResponse, RedirectResponse
-from fastapi.encoders import jsonable_encoder
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request
+from fastapi.responses import HTMLResponse, RedirectResponse
 
 from jose import JWTError, jwt
 
 from driver.dependencies import get_current_user_by_jwtoken
 from database import db as mongoDB
+from responses import ORJSONResponse
+from pagination import PageParams, paginate, page_cursor, page_response
+from streaming import wants_stream, stream_response
 
 from .models import UserModel, UserLoginModel, UpdateUserModel, ContactUs, Support, PasswordResetModel, ForgotPasswordResetModel, AddEmailModel
 from .exceptions import contactus_exception, support_exception
+from .cache import principal_cache
+from .pictures import UPLOAD_OPENAPI, read_picture, store_picture
+from .hashing import get_password_hash_async
 from .dependencies import *
 from .utils import (
                         authenticate_user, 
                         get_current_active_user, 
                         get_current_user, 
-                        get_password_hash, 
                         get_user,
-                        verify_password,
+                        verify_password_async,
                         create_access_token,
                         SendPasswordResetMail,
                         filter_none_and_empty_fields,
@@ -31,12 +35,18 @@ from .utils import (
                         SendAccountVerificationMail,
                         castObjectId,
                         sendmail,
-                        cloudinary
                 )
 
 
 
 
+USER_LIST_PROJECTION = {"password": 0}
+
+
+def encode_user(user: dict) -> dict:
+    return castObjectId(user)
+
+
 router = APIRouter(
     prefix="/api/auth/users",
     tags=["users"],
@@ -52,18 +62,18 @@ async def create_user(user: UserModel):
     # more error handling here pls
 
     if not check_mail:
-        hashed_password = get_password_hash(password=user.password)
+        hashed_password = await get_password_hash_async(password=user.password)
         user.password = hashed_password
 
         user.created_at = datetime.now()
         user.updated_at = datetime.now()
-        user_enc = jsonable_encoder(user)
+        user_enc = user.model_dump(mode="json")
         new_user = await mongoDB["users"].insert_one(user_enc)
         created_user = await mongoDB["users"].find_one({"_id": new_user.inserted_id})
         created_user["_id"] = str(created_user["_id"])
 
-        SendAccountVerificationMail(userid=created_user["_id"], name=user.name, to=user.email)
-        return JSONResponse(status_code=status.HTTP_201_CREATED, content=created_user)
+        await SendAccountVerificationMail(userid=created_user["_id"], name=user.name, to=user.email)
+        return ORJSONResponse(status_code=status.HTTP_201_CREATED, content=created_user)
     raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="user with the mail already exists")
 
 
@@ -71,9 +81,8 @@ async def create_user(user: UserModel):
 async def get_loggedin_user(user:Annotated[UserModel, Depends(get_current_user_by_jwtoken)]):
     if user:
         user.id = str(user.id)
-        user_enc = jsonable_encoder(user)
-        return JSONResponse(status_code=200, content=user_enc)
-    return JSONResponse(status_code=404, content={"error": "user not logged in"})
+        return ORJSONResponse(status_code=200, content=user)
+    return ORJSONResponse(status_code=404, content={"error": "user not logged in"})
 
 
 @router.get("/{userId}/user", response_description="get user by Id", response_model=UserModel)
@@ -86,9 +95,8 @@ async def get_user_by_Id(userId: str, user: Annotated[UserModel, Depends(get_cur
 
     if _user:
         castObjectId(_user)
-        user_enc = jsonable_encoder(_user)
-        return JSONResponse(status_code=200, content=user_enc)
-    return JSONResponse(status_code=404, content={"error": f"user with Id={userId} not found"})        
+        return ORJSONResponse(status_code=200, content=_user)
+    return ORJSONResponse(status_code=404, content={"error": f"user with Id={userId} not found"})        
 
 
 @router.put("/{userId}/update", response_description="Update User", response_model=str)
@@ -101,7 +109,7 @@ async def update_user(userId: str, user: UpdateUserModel, c_user: Annotated[User
 
     if to_update_user:
         # Convert the Pydantic model to a JSON serializable format
-        updated_user_enc = jsonable_encoder(user)
+        updated_user_enc = user.model_dump(mode="json")
 
         # Filter out None or empty fields
         filtered_update_data = filter_none_and_empty_fields(updated_user_enc)
@@ -109,26 +117,28 @@ async def update_user(userId: str, user: UpdateUserModel, c_user: Annotated[User
         update_result = await mongoDB["users"].update_one({"_id": user_id_object}, {"$set": filtered_update_data})
 
         if update_result.modified_count == 1:
+            principal_cache.invalidate(user_id=userId)
             # Document updated successfully
-            return JSONResponse(status_code=status.HTTP_200_OK, content={"message": "User updated successfully"})
+            return ORJSONResponse(status_code=status.HTTP_200_OK, content={"message": "User updated successfully"})
 
         # If the update didn't modify any document
-        return JSONResponse(status_code=status.HTTP_200_OK, content={"message": "User data unchanged"})
+        return ORJSONResponse(status_code=status.HTTP_200_OK, content={"message": "User data unchanged"})
 
     # User not found
     raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"User with ID {userId} not found")
 
 
 @router.get("/all", response_description="Get all Users", response_model=list[UserModel])
-async def get_all_users(user: Annotated[UserModel, Depends(get_current_user_by_jwtoken)]):
-    users = []
+async def get_all_users(request: Request, user: Annotated[UserModel, Depends(get_current_user_by_jwtoken)],
+                        page: Annotated[PageParams, Depends()], stream: bool = False):
+    if wants_stream(request, stream):
+        users_cursor = page_cursor(mongoDB["users"], {}, USER_LIST_PROJECTION, cursor=page.cursor, limit=0)
+        return stream_response(request, users_cursor, encode_user)
 
-    # Retrieve all user documents from the MongoDB collection
-    async for user in mongoDB["users"].find():
-        castObjectId(user)
-        users.append(user)
+    # Retrieve one page of user documents, password hashes never leave Mongo
+    users, next_cursor = await paginate(mongoDB["users"], {}, USER_LIST_PROJECTION, cursor=page.cursor, limit=page.limit)
 
-    return JSONResponse(status_code=status.HTTP_200_OK, content=users)
+    return page_response([encode_user(user) for user in users], next_cursor)
 
 
 @router.delete("/{userId}/delete", response_description="Delete User")
@@ -142,6 +152,7 @@ async def delete_user(userId: str, user: Annotated[UserModel, Depends(get_curren
     if to_delete_user:
         # Delete the user document
         await mongoDB["users"].delete_one({"_id": user_id_object})
+        principal_cache.invalidate(user_id=userId)
 
         return {"message": f"User with ID {userId} has been deleted"}
 
@@ -231,7 +242,7 @@ async def verifyAccount(userId: str, token: Annotated[str, Query] = None):
 
         uM.is_active = True
 
-        user_enc = jsonable_encoder(uM)
+        user_enc = uM.model_dump(mode="json")
 
                 # Filter out None or empty fields
         filtered_update_data = filter_none_and_empty_fields(user_enc)
@@ -239,6 +250,7 @@ async def verifyAccount(userId: str, token: Annotated[str, Query] = None):
         update_result = await mongoDB["users"].update_one({"_id": ObjectId(userId)}, {"$set": filtered_update_data})
 
         if update_result.modified_count == 1:
+            principal_cache.invalidate(user_id=userId)
             return RedirectResponse("https://app.wenyfour.com/auth")
         return HTMLResponse(content=html_content_err, status_code=400)
     
@@ -247,17 +259,18 @@ async def verifyAccount(userId: str, token: Annotated[str, Query] = None):
 async def resetPassword(password: PasswordResetModel, 
             current_user: Annotated[UserModel, Depends(get_current_user_by_jwtoken)]):
     if current_user:
-        if verify_password(password.password, current_user.password):
-            new_password = get_password_hash(password=password.new_password)
+        if await verify_password_async(password.password, current_user.password):
+            new_password = await get_password_hash_async(password=password.new_password)
             # Update the user document
             update_result = await mongoDB["users"].update_one({"_id": ObjectId(current_user.id)}, {"$set": {"password": new_password}})
 
             if update_result.modified_count == 1:
+                principal_cache.invalidate(user_id=current_user.id)
                 # Document updated successfully
-                return JSONResponse(status_code=status.HTTP_200_OK, content={"message": "User password updated successfully"})
+                return ORJSONResponse(status_code=status.HTTP_200_OK, content={"message": "User password updated successfully"})
 
             # If the update didn't modify any document
-            return JSONResponse(status_code=status.HTTP_200_OK, content={"message": "User data unchanged"})            
+            return ORJSONResponse(status_code=status.HTTP_200_OK, content={"message": "User data unchanged"})            
     raise credentials_exception
 
 
@@ -266,9 +279,9 @@ async def addForgetPasswordMail(email: AddEmailModel):
     if email:
         usermodel = await get_user(db=mongoDB, email=email.email)
         if usermodel:
-            SendPasswordResetMail(userid=usermodel.id, name=usermodel.name, to=email.email)
-            return JSONResponse(content={"message": "email sent successfully"}, status_code=status.HTTP_200_OK)
-    return JSONResponse(content={"error": "user with mail does not exists"}, status_code=status.HTTP_400_BAD_REQUEST)
+            await SendPasswordResetMail(userid=usermodel.id, name=usermodel.name, to=email.email)
+            return ORJSONResponse(content={"message": "email sent successfully"}, status_code=status.HTTP_200_OK)
+    return ORJSONResponse(content={"error": "user with mail does not exists"}, status_code=status.HTTP_400_BAD_REQUEST)
 
 
 @router.get("/{userId}/reset", response_description="reset a user's forgotten password")
@@ -310,68 +323,75 @@ async def resetAccountpswd(userId: str, token: Annotated[str, Query] = None):
 @router.post("/forgot/password/reset", response_description="reset a user's password after forgetting password")
 async def forgetPasswordReset(pswdmodel: ForgotPasswordResetModel):
     if pswdmodel: 
-        new_password = get_password_hash(password=pswdmodel.password)
+        new_password = await get_password_hash_async(password=pswdmodel.password)
         # Update the user document
         update_result = await mongoDB["users"].update_one({"email": pswdmodel.email}, {"$set": {"password": new_password}})
 
         if update_result.modified_count == 1:
+            principal_cache.invalidate(email=pswdmodel.email)
             # Document updated successfully
-            return JSONResponse(status_code=status.HTTP_200_OK, content={"message": "User password updated successfully"})
+            return ORJSONResponse(status_code=status.HTTP_200_OK, content={"message": "User password updated successfully"})
 
         # If the update didn't modify any document
-        return JSONResponse(status_code=status.HTTP_200_OK, content={"message": "User data unchanged"})            
+        return ORJSONResponse(status_code=status.HTTP_200_OK, content={"message": "User data unchanged"})            
     raise credentials_exception
 
 
 
 @router.post("/contact/us", response_description="contact us")
 async def contactUs(contactus: ContactUs):
-    contactus_enc = jsonable_encoder(contactus)
+    contactus_enc = contactus.model_dump()
     new_contactus = await mongoDB["contactus"].insert_one(contactus_enc)
     created_contactus = await mongoDB["contactus"].find_one({"_id": new_contactus.inserted_id})
 
     if created_contactus:
         mail_rep = os.environ["MAIL_R"]
         try:
-            sendmail(subject=contactus.subject, body=contactus.message, to=mail_rep)
+            await sendmail(subject=f"contact us message from {contactus.fullname}", body=contactus.message, to=mail_rep)
         except Exception as err:
             print(err, )
-        return JSONResponse(content={"message": "successfully created"}, status_code=status.HTTP_201_CREATED)
+        return ORJSONResponse(content={"message": "successfully created"}, status_code=status.HTTP_201_CREATED)
     raise contactus_exception
 
 
 @router.post("/support", response_description="contact support")
 async def support(support: Support):
-    support_enc = jsonable_encoder(support)
+    support_enc = support.model_dump()
     new_support = await mongoDB["support"].insert_one(support_enc)
     created_support = await mongoDB["support"].find_one({"_id": new_support.inserted_id})
 
     if created_support:
         mail_rep = os.environ["MAIL_R"]
         try:
-            sendmail(subject=support.subject, body=support.body, to=mail_rep)
+            await sendmail(subject=support.subject, body=support.body, to=mail_rep)
         except Exception as err:
             print(err, )
-        return JSONResponse(content={"message": "successfully created"}, status_code=status.HTTP_201_CREATED)
+        return ORJSONResponse(content={"message": "successfully created"}, status_code=status.HTTP_201_CREATED)
     raise support_exception
 
 
 
-@router.post("/upload/profile/picture", response_description="upload a user's profile picture")
-async def uploadProfilePicture(picture: Annotated[UploadFile, File()], current_user: Annotated[UserModel, Depends(get_current_user_by_jwtoken)]):
+@router.post("/upload/profile/picture", response_description="upload a user's profile picture", openapi_extra=UPLOAD_OPENAPI)
+async def uploadProfilePicture(request: Request, current_user: Annotated[UserModel, Depends(get_current_user_by_jwtoken)]):
+
+    data = await read_picture(request)
 
     try:
-        # Upload the file to Cloudinary
-        upload_result = cloudinary.uploader.upload(picture.file)
-
-        # You can access the Cloudinary URL for the uploaded file
-        file_url = upload_result['secure_url']
-
-        user = await mongoDB["users"].find_one({"_id": ObjectId(current_user.id)})
-        if user:
-            updated_user = await mongoDB["users"].update_one({"_id": ObjectId(current_user.id)}, {"$set": {"picture": file_url}})
-            if updated_user.modified_count == 1:
-                return JSONResponse(content={"message": "profile picture uploaded successfully!", "url": file_url}, status_code=status.HTTP_200_OK)
-            return JSONResponse(content={"error": "error updating profile picture"}, status_code=status.HTTP_400_BAD_REQUEST)
+        picture = await store_picture(data)
+    except HTTPException:
+        raise
     except Exception as e:
-        return JSONResponse(content={"error": str(e)}, status_code=500)
+        print(e, )
+        return ORJSONResponse(content={"error": "error uploading profile picture"}, status_code=status.HTTP_502_BAD_GATEWAY)
+
+    updated_user = await mongoDB["users"].update_one(
+        {"_id": ObjectId(current_user.id)},
+        {"$set": {"picture": picture["url"], "picture_thumbnail": picture["thumbnail_url"]}},
+    )
+    if updated_user.matched_count == 1:
+        principal_cache.invalidate(user_id=current_user.id)
+        return ORJSONResponse(
+            content={"message": "profile picture uploaded successfully!", "url": picture["url"], "thumbnail_url": picture["thumbnail_url"]},
+            status_code=status.HTTP_200_OK,
+        )
+    return ORJSONResponse(content={"error": "error updating profile picture"}, status_code=status.HTTP_400_BAD_REQUEST)
@@ -4,19 +4,18 @@ from fastapi.security import OAuth2PasswordBearer
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
-from passlib.context import CryptContext
-from jinja2 import Environment, FileSystemLoader
 import cloudinary
 import cloudinary.uploader
-import smtplib
-import ssl
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
 import os 
 
 
 from .models import UserModel, TokenData, UserLoginModel
+from .cache import principal_cache
+from .hashing import pwd_context, verify_password_async
+from .mailer import enqueue_mail
+from templating import render_template
 from database import db as mongoDB
+from metrics import auth_failures
 
 
 
@@ -32,20 +31,11 @@ HOST = os.environ["HOST"]
 
 BaseUrl = os.environ["BASE_PATH"]
 
-TEMP_ENV = Environment(loader=FileSystemLoader('templates'))  # Assuming your HTML file is in the current directory
-
-# Load HTML template
-confirm_email_template = TEMP_ENV.get_template('ConfirmEmailTemplate.html')  # Replace 'template.html' with the name of your HTML file
-
-
-forgot_pswd_template = TEMP_ENV.get_template('ForgotPasswordTemplate.html')
 
 class UserInDB(UserModel):
     hashed_password: str
 
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/users/login")
 oauth2_password_request_form = UserLoginModel
 
@@ -72,8 +62,10 @@ async def authenticate_user(db, username: str, password: str):
     user = await get_user(db, username)
 
     if not user:
+        auth_failures.inc(reason="unknown_user")
         return False
-    if not verify_password(password, user.password) or not user.is_active:
+    if not await verify_password_async(password, user.password) or not user.is_active:
+        auth_failures.inc(reason="bad_password_or_inactive")
         return False
     return user
 
@@ -95,18 +87,27 @@ async def get_current_user(token: str):
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    user = principal_cache.get(token)
+    if user is not None:
+        return user
+
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
 
         email: str = payload.get("sub")
         if email is None:
+            auth_failures.inc(reason="invalid_token")
             raise credentials_exception
         token_data = TokenData(email=email)
     except JWTError:
+        auth_failures.inc(reason="invalid_token")
         raise credentials_exception
     user = await get_user(db=mongoDB, email=token_data.email)
     if user is None or not user.is_active:
+        auth_failures.inc(reason="unknown_or_inactive_user")
         raise credentials_exception
+
+    principal_cache.set(token, user, token_exp=payload.get("exp"))
     return user
 
 
@@ -124,89 +125,24 @@ def filter_none_and_empty_fields(update_data):
 
 
 # Function to create email content from template
-def parse_verification_temp(name, link):
-    return confirm_email_template.render(name=name, link=link)
-
-
-def parse_verification_temp_reset_pswd(name, link):
-    return forgot_pswd_template.render(name=name, link=link)
+async def parse_verification_temp(name, link):
+    return await render_template("ConfirmEmailTemplate.html", name=name, link=link)
 
 
-def sendmail(subject, body, to):
+async def parse_verification_temp_reset_pswd(name, link):
+    return await render_template("ForgotPasswordTemplate.html", name=name, link=link)
 
-    gmail_user = os.environ["MAIL_USER"]
-    gmail_password = os.environ["MAIL_PASSWORD"]
 
-    sent_from = gmail_user
-    to = to
-    subject = subject
-    body = body
-    mailTo = None
-
-    email_text = body
-
-    try:
-        server = smtplib.SMTP_SSL('smtp.gmail.com', 465)
-        server.ehlo()
-        server.login(gmail_user, gmail_password)
-        server.sendmail(sent_from, to, email_text)
-        server.close()
-
-        print('Email sent!')
-    except Exception as err:
-        print('Something went wrong...')
+async def sendmail(subject, body, to):
+    # queued for the background mail dispatcher, the request doesn't wait on SMTP
+    await enqueue_mail(to=to, subject=subject, body=body, html=False)
 
 
+async def sendmailTemp(subject, to, content):
+    await enqueue_mail(to=to, subject=subject, body=content, html=True)
 
-def sendmailTemp(subject, to, content):
-    gmail_user = os.environ["MAIL_USER"]
-    gmail_password = os.environ["MAIL_PASSWORD"]
 
-    # Email configuration
-    smtp_server = 'smtp-relay.gmail.com'
-    smtp_port = 587  # or 465 for SSL
-
-    # Create message container
-    msg = MIMEMultipart('alternative')
-    msg['From'] = gmail_user
-    msg['To'] = to
-    msg['Subject'] = subject
-
-    # Attach HTML content
-    msg.attach(MIMEText(content, 'html'))
-    context = ssl.create_default_context()
-
-    try:
-        # Connect to SMTP server
-        """
-            server = smtplib.SMTP_SSL(smtp_server, smtp_port)
-            server.ehlo()
-            server.starttls(context=context)
-            server.ehlo()
-            #server.login(gmail_user, gmail_password)
-
-            # Send email
-            server.sendmail(gmail_user, to, msg.as_string())
-
-            # Close SMTP server
-            server.close()
-        """
-        
-        with smtplib.SMTP(smtp_server, smtp_port) as server:
-                server.ehlo()
-                server.starttls(context=context)
-                server.ehlo()             
-                server.login(gmail_user, gmail_password)  # if authentication required
-                server.sendmail(gmail_user, [to], msg.as_string())
-                 
-        print("email sent!")
-            
-    except Exception as err:
-        print(err)
-        print('something went wrong...')
-
-
-def SendAccountVerificationMail(userid, name, to):
+async def SendAccountVerificationMail(userid, name, to):
     access_token = create_access_token(
         data={"sub": to, "uid": userid}, expires_delta=timedelta(minutes=60)
     )
@@ -214,21 +150,21 @@ def SendAccountVerificationMail(userid, name, to):
 
     verificationLink = f"{BaseUrl}/{userid}/verify?token={access_token}"
 
-    content = parse_verification_temp(name=name, link=verificationLink)
+    content = await parse_verification_temp(name=name, link=verificationLink)
     
-    sendmailTemp(subject=subject, to = to, content = content)
+    await sendmailTemp(subject=subject, to = to, content = content)
 
 
-def SendPasswordResetMail(userid, name, to):
+async def SendPasswordResetMail(userid, name, to):
     access_token = create_access_token(
         data={"sub": to, "uid": userid}, expires_delta=timedelta(minutes=60)
     )
     subject = "Reset Your Password"
 
     verificationLink = f"{BaseUrl}/{userid}/reset?token={access_token}"
-    content = parse_verification_temp_reset_pswd(name=name, link=verificationLink)
+    content = await parse_verification_temp_reset_pswd(name=name, link=verificationLink)
     
-    sendmailTemp(subject=subject, to = to, content = content)
+    await sendmailTemp(subject=subject, to = to, content = content)
 
 
 def castObjectId(index: dict):
@@ -0,0 +1,42 @@
+"""
+    autocomplete lookup latency against an index holding the gazetteer plus
+    a few thousand synthetic locations.
+
+        python -m benchmarks.autocomplete [locations]
+"""
+import os
+import random
+import sys
+import time
+
+os.environ.setdefault("MONGODB_URL", "mongodb://localhost:27017")
+os.environ.setdefault("MONGODB_DB", "wenyfour_bench")
+
+from rides.locations import GAZETTEER, LocationIndex
+
+
+PREFIXES = ["k", "ka", "kan", "ab", "abu", "la", "lag", "port", "ph", "har", "ọ", "oso", "ile", "b", "z", "fct", "xyz"]
+
+
+def main(locations: int):
+    rng = random.Random(1)
+    counts = {name: rng.randrange(1, 5000) for name in GAZETTEER}
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    for _ in range(locations):
+        counts["".join(rng.choice(letters) for _ in range(rng.randrange(4, 12)))] = rng.randrange(1, 50)
+
+    started = time.perf_counter()
+    index = LocationIndex(counts)
+    print(f"built {index.stats()} in {(time.perf_counter() - started) * 1000:.1f}ms")
+
+    iterations = 2000
+    for prefix in PREFIXES:
+        started = time.perf_counter()
+        for _ in range(iterations):
+            suggestions = index.suggest(prefix)
+        took = (time.perf_counter() - started) / iterations * 1_000_000
+        print(f"{prefix!r:>8} {took:>8.1f}us  {[s['name'] for s in suggestions[:3]]}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
@@ -0,0 +1,79 @@
+"""
+    concurrency check for book_ride: a few hundred riders book the same ride
+    at once and the ride is checked for overselling afterwards. available
+    seats must never go below zero, the passengers pushed onto the ride must
+    add up to the seats taken, and the passengers collection must hold the
+    same bookings. exits non-zero if any check fails.
+
+        pip install -r requirements-bench.txt               # mongomock for the default runs
+        python -m benchmarks.booking_race                   # in-process mongomock
+        python -m benchmarks.booking_race --mongo           # MONGODB_URL, drops MONGODB_DB first
+        python -m benchmarks.booking_race --riders 500 --seats 40 --max-seats 3
+"""
+import argparse
+import asyncio
+import random
+import sys
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+from benchmarks.loadtest import use_database
+
+
+async def main(args) -> bool:
+    db = use_database(args.mongo)
+    from auth.models import UserModel
+    from rides.models import Passenger
+    from rides.router import book_ride
+
+    for collection in ("rides", "passengers"):
+        await db[collection].drop()
+
+    ride_id = ObjectId()
+    await db["rides"].insert_one({
+        "_id": ride_id, "from_location": "kano", "to_location": "abuja", "seats": args.seats,
+        "available_seats": args.seats, "seat_price": 100, "expired": False, "passengers": [],
+        "departure": datetime.now() + timedelta(days=1),
+    })
+
+    rng = random.Random(args.seed)
+    riders = [
+        (UserModel(id=str(ObjectId()), name=f"rider{i}", email=f"rider{i}@bench.wenyfour.com", phone="0", nin="0", password="x", is_active=True),
+         Passenger(no_seats=rng.randint(1, args.max_seats)))
+        for i in range(args.riders)
+    ]
+
+    responses = await asyncio.gather(*(book_ride(str(ride_id), passenger, user) for user, passenger in riders))
+    outcomes = {}
+    for response in responses:
+        outcomes[response.status_code] = outcomes.get(response.status_code, 0) + 1
+
+    ride = await db["rides"].find_one({"_id": ride_id})
+    pushed = sum(passenger["no_seats"] for passenger in ride["passengers"])
+    stored = [passenger async for passenger in db["passengers"].find({"ride_id": str(ride_id)})]
+    booked = sum(response.status_code == 200 for response in responses)
+
+    checks = {
+        "available_seats >= 0": ride["available_seats"] >= 0,
+        "seats pushed == seats - available_seats": pushed == args.seats - ride["available_seats"],
+        "passengers collection matches the ride": sorted(p["id"] for p in ride["passengers"]) == sorted(str(p["_id"]) for p in stored),
+        "one passenger per successful booking": booked == len(ride["passengers"]),
+    }
+
+    print(f"{args.riders} riders, {args.seats} seats, up to {args.max_seats} seats each")
+    print(f"responses by status: {dict(sorted(outcomes.items()))}")
+    print(f"seats left {ride['available_seats']}, passengers {len(ride['passengers'])}, seats pushed {pushed}")
+    for name, passed in checks.items():
+        print(f"{'ok  ' if passed else 'FAIL'} {name}")
+    return all(checks.values())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo", action="store_true", help="use the MongoDB at MONGODB_URL instead of mongomock")
+    parser.add_argument("--riders", type=int, default=300)
+    parser.add_argument("--seats", type=int, default=50)
+    parser.add_argument("--max-seats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    sys.exit(0 if asyncio.run(main(parser.parse_args())) else 1)
@@ -0,0 +1,212 @@
+"""
+    synthetic users, cars, rides (with their passengers) and transactions
+    shaped like the interstate routes the app actually serves. everything is
+    driven by one seed so two runs against different commits see the same data.
+"""
+import random
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+
+BENCH_PASSWORD = "bench-password"
+
+# how clients send ride dates and times, see rides.utils.DEPARTURE_FORMAT
+DATE_FORMAT = "%Y-%d-%m"
+TIME_FORMAT = "%H:%M"
+
+# (from, to, typical seat price in naira, relative demand)
+ROUTES = [
+    ("lagos", "ibadan", 6000, 30),
+    ("lagos", "benin", 15000, 14),
+    ("lagos", "abuja", 28000, 12),
+    ("abuja", "kaduna", 9000, 20),
+    ("kaduna", "kano", 8000, 16),
+    ("kano", "abuja", 14000, 12),
+    ("abuja", "jos", 10000, 8),
+    ("abuja", "lokoja", 7000, 7),
+    ("enugu", "port harcourt", 11000, 9),
+    ("onitsha", "lagos", 18000, 8),
+    ("owerri", "abuja", 22000, 5),
+    ("ibadan", "ilorin", 6500, 6),
+    ("benin", "asaba", 5000, 6),
+    ("calabar", "uyo", 4500, 4),
+    ("abeokuta", "lagos", 3500, 10),
+    ("kano", "katsina", 6000, 5),
+    ("maiduguri", "damaturu", 5500, 2),
+    ("sokoto", "birnin kebbi", 5000, 2),
+]
+
+PICKUPS = {
+    "lagos": ["ojota park", "jibowu", "berger", "ikeja along", "mile 2"],
+    "ibadan": ["iwo road", "challenge", "ojoo"],
+    "benin": ["ring road", "uselu"],
+    "abuja": ["jabi park", "utako", "wuse 2", "area 1", "kubwa"],
+    "kaduna": ["kawo", "mando", "central market"],
+    "kano": ["zaria road", "kofar ruwa", "naibawa"],
+    "jos": ["terminus", "bauchi road"],
+    "lokoja": ["ganaja junction"],
+    "enugu": ["holy ghost", "ogbete"],
+    "port harcourt": ["garrison", "waterlines", "mile 1"],
+    "onitsha": ["upper iweka"],
+    "owerri": ["douglas road", "relief market"],
+    "ilorin": ["post office", "tanke"],
+    "asaba": ["summit junction"],
+    "calabar": ["marian road"],
+    "uyo": ["itam park"],
+    "abeokuta": ["kuto", "panseke"],
+    "katsina": ["kofar kaura"],
+    "maiduguri": ["post office"],
+    "damaturu": ["central park"],
+    "sokoto": ["old airport"],
+    "birnin kebbi": ["central motor park"],
+}
+
+# city centres as (longitude, latitude), pickup parks sit a few km around them
+CITY_COORDINATES = {
+    "lagos": (3.3792, 6.5244), "ibadan": (3.9470, 7.3775), "benin": (5.6037, 6.3350), "abuja": (7.4951, 9.0579),
+    "kaduna": (7.4388, 10.5105), "kano": (8.5167, 11.9964), "jos": (8.8921, 9.8965), "lokoja": (6.7333, 7.8023),
+    "enugu": (7.4951, 6.4584), "port harcourt": (7.0134, 4.8156), "onitsha": (6.7870, 6.1413), "owerri": (7.0352, 5.4891),
+    "ilorin": (4.5418, 8.4966), "asaba": (6.7333, 6.2000), "calabar": (8.3417, 4.9757), "uyo": (7.9090, 5.0377),
+    "abeokuta": (3.3515, 7.1475), "katsina": (7.6006, 12.9908), "maiduguri": (13.1571, 11.8311), "damaturu": (11.9608, 11.7470),
+    "sokoto": (5.2476, 13.0059), "birnin kebbi": (4.1975, 12.4539),
+}
+
+# about 0.01 degrees per km near the equator
+KM = 0.009
+
+
+def pickup_coordinates(city: str, pickup: str) -> tuple:
+    # a stable spot for each park, up to ~8 km from the city centre
+    rng = random.Random(f"{city}/{pickup}")
+    longitude, latitude = CITY_COORDINATES[city]
+    return longitude + rng.uniform(-8, 8) * KM, latitude + rng.uniform(-8, 8) * KM
+
+
+def geo_point(rng: random.Random, city: str, pickup: str, spread_km: float = 0.5) -> dict:
+    longitude, latitude = pickup_coordinates(city, pickup)
+    return {
+        "type": "Point",
+        "coordinates": [round(longitude + rng.uniform(-spread_km, spread_km) * KM, 6), round(latitude + rng.uniform(-spread_km, spread_km) * KM, 6)],
+    }
+
+
+FIRST_NAMES = ["Musa", "Chinedu", "Aisha", "Tunde", "Ngozi", "Ibrahim", "Funmilayo", "Emeka", "Zainab", "Yemi", "Halima", "Obinna", "Bola", "Fatima", "Ikechukwu", "Kemi"]
+LAST_NAMES = ["Abdullahi", "Okafor", "Bello", "Adeyemi", "Eze", "Mohammed", "Olawale", "Nwosu", "Usman", "Adebayo", "Okonkwo", "Sani"]
+CARS = [("corolla", "toyota", "sedan"), ("camry", "toyota", "sedan"), ("sienna", "toyota", "bus"), ("accord", "honda", "sedan"), ("hiace", "toyota", "bus"), ("elantra", "hyundai", "sedan")]
+COLORS = ["silver", "black", "white", "blue", "red", "grey"]
+
+
+def route_weights() -> list:
+    return [route[3] for route in ROUTES]
+
+
+def pick_route(rng: random.Random, reverse_ok: bool = True) -> tuple:
+    origin, destination, price, _ = rng.choices(ROUTES, weights=route_weights())[0]
+    if reverse_ok and rng.random() < 0.5:
+        origin, destination = destination, origin
+    return origin, destination, price
+
+
+def ride_payload(rng: random.Random, departure: datetime, car_id: str) -> dict:
+    # the body a driver posts to /api/rides/create
+    origin, destination, price = pick_route(rng)
+    seats = rng.choice([3, 4, 4, 4, 7, 14])
+    pickup, dropoff = rng.choice(PICKUPS[origin]), rng.choice(PICKUPS[destination])
+    return {
+        "date": departure.strftime(DATE_FORMAT),
+        "time": departure.strftime(TIME_FORMAT),
+        "from_location": origin,
+        "to_location": destination,
+        "pickup_location": pickup,
+        "dropoff_location": dropoff,
+        "pickup_point": geo_point(rng, origin, pickup),
+        "dropoff_point": geo_point(rng, destination, dropoff),
+        "gender": rng.choice(["any", "any", "any", "female", "male"]),
+        "seats": seats,
+        "seat_price": float(round(price * rng.uniform(0.8, 1.3), -2)),
+        "car_id": car_id,
+    }
+
+
+def generate(users: int, cars: int, rides: int, transactions: int, password_hash: str, seed: int = 0, now: datetime = None) -> dict:
+    """
+        build the documents for every collection. cars belong to the first
+        `cars` users (the drivers), rides are spread from two days ago to two
+        weeks ahead and already carry their passengers, so the `passengers`
+        collection matches what book_ride would have written.
+    """
+    rng = random.Random(seed)
+    now = (now or datetime.now()).replace(second=0, microsecond=0)
+    created = now - timedelta(days=90)
+
+    user_docs = []
+    for i in range(users):
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        user_docs.append({
+            "_id": ObjectId(), "name": f"{first} {last}", "email": f"bench{i}@example.com",
+            "phone": f"234803{rng.randrange(10 ** 7):07d}", "nin": f"{rng.randrange(10 ** 11):011d}",
+            "date_of_birth": None, "about": "", "picture": None, "password": password_hash,
+            "is_active": True, "created_at": created, "updated_at": created,
+        })
+
+    car_docs = []
+    for i in range(min(cars, users)):
+        model, brand, c_type = rng.choice(CARS)
+        car_docs.append({
+            "_id": ObjectId(), "model": model, "brand": brand, "color": rng.choice(COLORS), "c_type": c_type,
+            "c_license": f"{rng.choice(['LAG', 'ABJ', 'KAN', 'KAD', 'ENU'])}{rng.randrange(1000):03d}XY",
+            "user_id": str(user_docs[i]["_id"]),
+        })
+
+    ride_docs, passenger_docs = [], []
+    for _ in range(rides if car_docs else 0):
+        car = rng.choice(car_docs)
+        departure = now + timedelta(minutes=rng.randrange(-2 * 24 * 60, 14 * 24 * 60, 15))
+        ride = ride_payload(rng, departure, str(car["_id"]))
+        ride.update({
+            "_id": ObjectId(), "driver_id": car["user_id"], "departure": departure,
+            "expired": departure < now, "available_seats": ride["seats"], "passengers": [],
+        })
+
+        for _ in range(rng.randrange(ride["seats"])):
+            rider = rng.choice(user_docs)
+            if rider["_id"] == ObjectId(car["user_id"]):
+                continue
+            no_seats = min(rng.choice([1, 1, 1, 2]), ride["available_seats"])
+            if not no_seats:
+                break
+            passenger = {
+                "id": str(ObjectId()), "user_id": str(rider["_id"]), "ride_id": str(ride["_id"]),
+                "no_seats": no_seats, "price": ride["seat_price"] * no_seats,
+            }
+            ride["available_seats"] -= no_seats
+            ride["passengers"].append(passenger)
+            passenger_docs.append({"_id": ObjectId(passenger["id"]), **passenger})
+        ride_docs.append(ride)
+
+    names = {str(user["_id"]): user["name"] for user in user_docs}
+    transaction_docs = []
+    for i in range(transactions if passenger_docs else 0):
+        booking = rng.choice(passenger_docs)
+        transaction_docs.append({
+            "_id": ObjectId(), "userid": booking["user_id"], "message": "Approved", "amount": booking["price"],
+            "timestamp": now - timedelta(minutes=rng.randrange(60 * 24 * 60)), "status": "success",
+            "name": names[booking["user_id"]], "seats": booking["no_seats"],
+            "trxn_referenceid": str(1712408531164 + i), "transactionid": str(3691543628 + i),
+        })
+
+    return {
+        "users": user_docs,
+        "cars": car_docs,
+        "rides": ride_docs,
+        "passengers": passenger_docs,
+        "transactions": transaction_docs,
+    }
+
+
+async def seed(db, data: dict, chunk_size: int = 1000):
+    for collection, docs in data.items():
+        await db[collection].drop()
+        for start in range(0, len(docs), chunk_size):
+            await db[collection].insert_many(docs[start:start + chunk_size], ordered=False)
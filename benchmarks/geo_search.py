@@ -0,0 +1,78 @@
+"""
+    pickup search on a seeded dataset: text matching on the route plus the
+    pickup park name (what a rider could do before) against $geoNear within a
+    radius of the rider. reports latency and how many rides each one finds.
+    mongomock has no $geoNear, so without --mongo only the text mode runs.
+
+        pip install -r requirements-bench.txt               # mongomock for the default runs
+        python -m benchmarks.geo_search                     # in-process mongomock, text mode only
+        python -m benchmarks.geo_search --mongo             # MONGODB_URL, drops MONGODB_DB first
+        python -m benchmarks.geo_search --mongo --rides 20000 --queries 300 --radius-km 5
+"""
+import argparse
+import asyncio
+import random
+import time
+from datetime import datetime
+
+from benchmarks.dataset import PICKUPS, generate, geo_point, pick_route, seed
+from benchmarks.loadtest import percentile, use_database
+
+
+async def main(args):
+    import database
+    from rides.utils import geo_search
+    from schema import ensure_indexes
+
+    db = use_database(args.mongo)
+    data = generate(args.users, args.cars, args.rides, 0, "x", seed=args.seed)
+    await seed(db, data)
+    if args.mongo:
+        await ensure_indexes()
+    modes = ("text", "geo") if args.mongo else ("text",)
+
+    rng = random.Random(args.seed)
+    timings = {"text": [], "geo": []}
+    found = {"text": [], "geo": []}
+    for _ in range(args.queries):
+        origin, destination, _ = pick_route(rng)
+        pickup = rng.choice(PICKUPS[origin])
+        # the rider stands within a couple of km of a park they may not know the name of
+        rider = geo_point(rng, origin, pickup, spread_km=2)["coordinates"]
+        base = {"from_location": origin, "to_location": destination, "departure": {"$gt": datetime.now()},
+                "available_seats": {"$gte": 1}, "expired": False}
+
+        start = time.perf_counter()
+        rides = await db["rides"].find({**base, "pickup_location": pickup}, {"passengers": 0}).sort("departure", 1).to_list(length=args.limit)
+        timings["text"].append(time.perf_counter() - start)
+        found["text"].append(len(rides))
+
+        if "geo" not in modes:
+            continue
+        start = time.perf_counter()
+        rides, _ = await geo_search(db, base, rider[0], rider[1], args.radius_km * 1000, limit=args.limit)
+        timings["geo"].append(time.perf_counter() - start)
+        found["geo"].append(len(rides))
+
+    print(f"{args.rides} rides, {args.queries} queries, radius {args.radius_km} km, page of {args.limit}")
+    print(f"{'mode':<6}{'p50 ms':>10}{'p99 ms':>10}{'avg rides':>12}{'empty':>8}")
+    for mode in modes:
+        samples = sorted(timings[mode])
+        print(f"{mode:<6}{percentile(samples, 50) * 1000:>10.2f}{percentile(samples, 99) * 1000:>10.2f}"
+              f"{sum(found[mode]) / len(found[mode]):>12.1f}{found[mode].count(0):>8}")
+    if not args.mongo:
+        print("geo needs --mongo, mongomock has no $geoNear")
+    database.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo", action="store_true", help="use the MongoDB at MONGODB_URL instead of mongomock")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--cars", type=int, default=400)
+    parser.add_argument("--rides", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--radius-km", type=float, default=5)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    asyncio.run(main(parser.parse_args()))
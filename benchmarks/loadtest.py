@@ -0,0 +1,240 @@
+"""
+    seeds a database with synthetic routes, users and bookings, then drives
+    the real app in-process over httpx with a weighted mix of login, search,
+    book, list and create requests. prints throughput and p50/p99 per
+    endpoint and writes the run to a JSON file for comparison across commits.
+
+        pip install -r requirements-bench.txt               # mongomock for the default runs
+        python -m benchmarks.loadtest                       # in-process mongomock
+        python -m benchmarks.loadtest --mongo               # MONGODB_URL, drops MONGODB_DB first
+        python -m benchmarks.loadtest --requests 5000 --concurrency 64 --compare old.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.dataset import BENCH_PASSWORD, generate, pick_route, ride_payload, seed
+
+os.environ.setdefault("MONGODB_URL", "mongodb://localhost:27017")
+os.environ.setdefault("MONGODB_DB", "wenyfour_bench")
+for name in ("HOST", "BASE_PATH", "MAIL_USER", "MAIL_R", "CLOUDINARY_NAME", "CLOUDINARY_API_KEY", "CLOUDINARY_API_SECRET"):
+    os.environ.setdefault(name, "bench")
+
+
+DEFAULT_MIX = "search=50,list=20,book=12,login=8,create=10"
+
+
+def parse_mix(mix: str) -> dict:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        weights[name.strip()] = float(weight)
+    return weights
+
+
+def percentile(sorted_values: list, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def git_revision() -> dict:
+    def git(*args):
+        try:
+            return subprocess.run(["git", *args], capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return ""
+    return {"commit": git("rev-parse", "--short", "HEAD"), "dirty": bool(git("status", "--porcelain", "--untracked-files=no"))}
+
+
+def use_database(mongo: bool):
+    import database
+    if mongo:
+        # the benchmarks drop what they seed, never let that be a real database
+        name = os.environ["MONGODB_DB"]
+        if not any(marker in name.lower() for marker in ("bench", "test")):
+            raise SystemExit(f"refusing to seed MONGODB_DB={name!r}, use a database with bench or test in its name")
+        return database.connect()
+    from mongomock_motor import AsyncMongoMockClient
+    return database.connect(client=AsyncMongoMockClient())
+
+
+class Traffic:
+    # picks requests for the virtual users and records how each one went
+
+    def __init__(self, client, data: dict, tokens: dict, seed: int):
+        self.client = client
+        self.rng = random.Random(seed)
+        self.users = data["users"]
+        self.tokens = tokens
+        self.cars = {car["user_id"]: str(car["_id"]) for car in data["cars"]}
+        self.drivers = list(self.cars)
+        self.future_rides = [str(ride["_id"]) for ride in data["rides"] if not ride["expired"]]
+        self.samples = {}
+        self.statuses = {}
+
+    def headers(self, user: dict) -> dict:
+        return {"x-token": self.tokens[str(user["_id"])]}
+
+    async def login(self):
+        user = self.rng.choice(self.users)
+        return await self.client.post("/api/auth/users/login", json={"email": user["email"], "password": BENCH_PASSWORD})
+
+    async def search(self):
+        origin, destination, _ = pick_route(self.rng)
+        params = {"start_loc": origin, "to_loc": destination, "seats": self.rng.choice([1, 1, 1, 2])}
+        return await self.client.get("/api/rides/q/search/ride", params=params, headers=self.headers(self.rng.choice(self.users)))
+
+    async def book(self):
+        ride_id = self.rng.choice(self.future_rides)
+        user = self.rng.choice(self.users)
+        return await self.client.put(f"/api/rides/{ride_id}/book/ride", json={"no_seats": 1}, headers=self.headers(user))
+
+    async def list(self):
+        user = self.rng.choice(self.users)
+        path = self.rng.choice([
+            "/api/rides/published/rides",
+            f"/api/rides/{user['_id']}/ordered/ride",
+            f"/api/transactions/{user['_id']}/transactions",
+        ])
+        return await self.client.get(path, headers=self.headers(user))
+
+    async def create(self):
+        driver_id = self.rng.choice(self.drivers)
+        departure = datetime.now() + timedelta(minutes=self.rng.randrange(60, 14 * 24 * 60, 15))
+        body = ride_payload(self.rng, departure, self.cars[driver_id])
+        return await self.client.post("/api/rides/create", json=body, headers={"x-token": self.tokens[driver_id]})
+
+    async def run_one(self, op: str):
+        start = time.perf_counter()
+        try:
+            response = await getattr(self, op)()
+            status = response.status_code
+        except Exception as err:
+            print(op, err, )
+            status = "exception"
+        elapsed = time.perf_counter() - start
+
+        self.samples.setdefault(op, []).append(elapsed)
+        statuses = self.statuses.setdefault(op, {})
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+
+async def drive(traffic: Traffic, mix: dict, requests: int, concurrency: int) -> float:
+    ops = traffic.rng.choices(list(mix), weights=list(mix.values()), k=requests)
+    queue = asyncio.Queue()
+    for op in ops:
+        queue.put_nowait(op)
+
+    async def worker():
+        while not queue.empty():
+            await traffic.run_one(queue.get_nowait())
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return time.perf_counter() - start
+
+
+def summarize(traffic: Traffic, elapsed: float) -> dict:
+    endpoints = {}
+    for op, samples in sorted(traffic.samples.items()):
+        samples.sort()
+        statuses = traffic.statuses[op]
+        endpoints[op] = {
+            "requests": len(samples),
+            "errors": sum(count for status, count in statuses.items() if not status.startswith(("2", "409"))),
+            "statuses": statuses,
+            "throughput_rps": len(samples) / elapsed,
+            "p50_ms": percentile(samples, 50) * 1000,
+            "p99_ms": percentile(samples, 99) * 1000,
+            "mean_ms": sum(samples) / len(samples) * 1000,
+            "max_ms": samples[-1] * 1000,
+        }
+    total = sum(len(samples) for samples in traffic.samples.values())
+    return {"elapsed_s": elapsed, "throughput_rps": total / elapsed, "endpoints": endpoints}
+
+
+def print_report(results: dict, baseline: dict = None):
+    print(f"{results['summary']['throughput_rps']:.1f} req/s over {results['summary']['elapsed_s']:.2f}s "
+          f"({results['meta']['backend']}, commit {results['meta']['commit'] or '?'})")
+    print(f"{'endpoint':<10}{'reqs':>7}{'errors':>8}{'req/s':>9}{'p50 ms':>10}{'p99 ms':>10}")
+    for op, row in results["summary"]["endpoints"].items():
+        line = f"{op:<10}{row['requests']:>7}{row['errors']:>8}{row['throughput_rps']:>9.1f}{row['p50_ms']:>10.2f}{row['p99_ms']:>10.2f}"
+        old = (baseline or {}).get("summary", {}).get("endpoints", {}).get(op)
+        if old:
+            line += f"   p50 {row['p50_ms'] - old['p50_ms']:+.2f}  p99 {row['p99_ms'] - old['p99_ms']:+.2f} vs {baseline['meta'].get('commit') or '?'}"
+        print(line)
+
+
+async def main(args):
+    import main as app_module
+    db = use_database(args.mongo)
+    from auth.hashing import pwd_context
+    from auth.utils import create_access_token
+    from httpx import ASGITransport, AsyncClient
+
+    data = generate(args.users, args.cars, args.rides, args.transactions, pwd_context.hash(BENCH_PASSWORD), seed=args.seed)
+    await seed(db, data)
+    if args.mongo:
+        from schema import ensure_indexes
+        await ensure_indexes()
+
+    # sessions for the virtual users, login traffic is measured separately
+    tokens = {
+        str(user["_id"]): create_access_token({"sub": user["email"]}, expires_delta=timedelta(hours=1))
+        for user in data["users"]
+    }
+
+    transport = ASGITransport(app=app_module.app)
+    async with AsyncClient(transport=transport, base_url="http://bench") as client:
+        traffic = Traffic(client, data, tokens, args.seed)
+        if args.warmup:
+            await drive(traffic, parse_mix(args.mix), args.warmup, args.concurrency)
+            traffic.samples, traffic.statuses = {}, {}
+        elapsed = await drive(traffic, parse_mix(args.mix), args.requests, args.concurrency)
+
+    results = {
+        "meta": {
+            **git_revision(),
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "backend": "mongodb" if args.mongo else "mongomock",
+            "params": {key: value for key, value in vars(args).items() if key not in ("out", "compare")},
+        },
+        "summary": summarize(traffic, elapsed),
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+
+    out = args.out or f"loadtest-{results['meta']['commit'] or 'local'}.json"
+    with open(out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"results written to {out}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo", action="store_true", help="use the MongoDB at MONGODB_URL instead of mongomock")
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--cars", type=int, default=100)
+    parser.add_argument("--rides", type=int, default=2000)
+    parser.add_argument("--transactions", type=int, default=2000)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--warmup", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="weighted ops, e.g. search=50,book=10")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="results file, defaults to loadtest-<commit>.json")
+    parser.add_argument("--compare", help="earlier results file to diff p50/p99 against")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,56 @@
+"""
+    compares sending mail over a fresh SMTP connection per message (the old
+    sendmail/sendmailTemp behaviour) with the dispatcher's persistent
+    connection, against a local SMTP sink.
+
+        python -m benchmarks.mail_throughput [messages]
+"""
+import asyncio
+import os
+import sys
+import time
+
+os.environ.setdefault("MONGODB_URL", "mongodb://localhost:27017")
+os.environ.setdefault("MONGODB_DB", "wenyfour_bench")
+os.environ.setdefault("MAIL_USER", "support@wenyfour.com")
+os.environ["MAIL_SERVER"] = "127.0.0.1"
+os.environ.pop("MAIL_PASSWORD", None)
+
+from benchmarks.smtp_sink import SMTPSink
+
+
+async def main(count: int):
+    sink = await SMTPSink().start()
+
+    # the mailer reads its settings at import time
+    os.environ["MAIL_PORT"] = str(sink.port)
+    from auth import mailer
+
+    mails = [{"to": f"user{i}@example.com", "subject": "Verify your account", "body": "<p>hello</p>"} for i in range(count)]
+    results = {}
+
+    start = time.perf_counter()
+    for mail in mails:
+        smtp = mailer.smtp_client()
+        await smtp.connect()
+        await smtp.send_message(mailer.build_message(mail["to"], mail["subject"], mail["body"]))
+        await smtp.quit()
+    results["connection per message"] = count / (time.perf_counter() - start)
+
+    dispatcher = mailer.MailDispatcher()
+    start = time.perf_counter()
+    smtp = None
+    for mail in mails:
+        smtp = await dispatcher.deliver(smtp, mail)
+    await smtp.quit()
+    results["pooled connection"] = count / (time.perf_counter() - start)
+
+    await sink.stop()
+
+    for name, rate in results.items():
+        print(f"{name:<24} {rate:10.1f} msg/s")
+    print(f"sink received {sink.messages} messages over {sink.connections} connections")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 500))
@@ -0,0 +1,67 @@
+"""
+    per-response CPU for ride and user payloads: the old jsonable_encoder +
+    stdlib JSONResponse path against a single ORJSONResponse render.
+
+        python -m benchmarks.serialization [iterations]
+"""
+import sys
+import time
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from responses import ORJSONResponse
+
+
+def ride_doc(i: int) -> dict:
+    departure = datetime(2024, 10, 1, 18, 30) + timedelta(hours=i)
+    return {
+        "_id": ObjectId(), "date": departure.strftime("%Y-%d-%m"), "time": departure.strftime("%H:%M"),
+        "from_location": "kano", "to_location": "abuja", "pickup_location": "zaria road", "dropoff_location": "wuse 2",
+        "gender": "any", "seats": 4, "seat_price": 8500.0, "car_id": str(ObjectId()), "driver_id": str(ObjectId()),
+        "expired": False, "available_seats": 2, "departure": departure,
+        "car_model": "camry", "car_color": "silver", "car_type": "sedan", "driver_name": "Musa Abdullahi", "driver_phone": "2348031234567",
+    }
+
+
+def user_doc(i: int) -> dict:
+    return {
+        "_id": ObjectId(), "name": f"user {i}", "email": f"user{i}@example.com", "phone": "2348031234567", "nin": "30082856600",
+        "date_of_birth": "1995-04-12", "about": "", "picture": "https://res.cloudinary.com/wenyfour/image/upload/v1/p.jpg",
+        "is_active": True, "created_at": datetime(2024, 1, 5, 9, 0), "updated_at": datetime(2024, 1, 5, 9, 0),
+    }
+
+
+def old_path(docs):
+    # what the routers used to do: jsonable_encoder, then stdlib json in JSONResponse
+    return JSONResponse(content=jsonable_encoder(docs, custom_encoder={ObjectId: str})).body
+
+
+def new_path(docs):
+    return ORJSONResponse(content=docs).body
+
+
+def per_call(func, payload, iterations: int) -> float:
+    start = time.process_time()
+    for _ in range(iterations):
+        func(payload)
+    return (time.process_time() - start) / iterations
+
+
+def main(iterations: int):
+    payloads = {
+        "ride search page (20)": [ride_doc(i) for i in range(20)],
+        "ride list page (100)": [ride_doc(i) for i in range(100)],
+        "user list page (100)": [user_doc(i) for i in range(100)],
+        "single user": user_doc(0),
+    }
+    for name, payload in payloads.items():
+        before = per_call(old_path, payload, iterations)
+        after = per_call(new_path, payload, iterations)
+        print(f"{name:<24} jsonable+json {before * 1e6:9.1f} us   orjson {after * 1e6:8.1f} us   saved {(before - after) * 1e6:9.1f} us ({before / after:5.1f}x)")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
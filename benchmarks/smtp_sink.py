@@ -0,0 +1,55 @@
+import asyncio
+
+
+class SMTPSink:
+    """
+        minimal local SMTP server that accepts and discards every message.
+        stands in for the real relay when measuring mail throughput.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.host = host
+        self.port = port
+        self.messages = 0
+        self.connections = 0
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+
+        async def reply(line: str):
+            writer.write(f"{line}\r\n".encode())
+            await writer.drain()
+
+        await reply("220 localhost sink ready")
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            command = line.decode(errors="replace").strip().upper()
+
+            if command.startswith(("EHLO", "HELO")):
+                await reply("250-localhost\r\n250-8BITMIME\r\n250 SIZE 10485760")
+            elif command == "DATA":
+                await reply("354 end data with <CR><LF>.<CR><LF>")
+                while (await reader.readline()) not in (b".\r\n", b".\n", b""):
+                    pass
+                self.messages += 1
+                await reply("250 queued")
+            elif command == "QUIT":
+                await reply("221 bye")
+                break
+            else:
+                # MAIL, RCPT, RSET, NOOP
+                await reply("250 ok")
+
+        writer.close()
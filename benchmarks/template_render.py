@@ -0,0 +1,52 @@
+"""
+    renders per second for the transactional email templates, comparing the
+    old per-process setup (relative FileSystemLoader, compiled on first use,
+    sync render) with the precompiled, bytecode-cached async environment.
+
+        python -m benchmarks.template_render [renders]
+"""
+import asyncio
+import sys
+import time
+
+from jinja2 import Environment, FileSystemLoader
+
+from templating import TEMPLATES_DIR, TEMP_ENV, precompile_templates, render_many
+
+
+CONTEXTS = {
+    "ConfirmEmailTemplate.html": {"name": "Aisha Bello", "link": "https://api.wenyfour.com/api/auth/users/650/verify?token=abc"},
+    "ForgotPasswordTemplate.html": {"name": "Aisha Bello", "link": "https://api.wenyfour.com/api/auth/users/650/reset?token=abc"},
+    "invoice.html": {
+        "name": "Aisha Bello", "email": "aisha@example.com", "reference": "1712408531164", "transaction_id": "3691543628",
+        "date": "06/04/2024", "description": "Payment for the trip from kano to abuja", "seats": 2, "unit_price": 6000.0, "amount": 12000.0,
+    },
+}
+
+
+def timed(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def main(count: int):
+    # cost of getting every template ready in a fresh worker
+    cold_env = Environment(loader=FileSystemLoader(TEMPLATES_DIR))
+    cold = timed(lambda: [cold_env.get_template(name) for name in CONTEXTS])
+    precompile_templates()
+    TEMP_ENV.cache.clear()
+    warm = timed(precompile_templates)
+    print(f"{'compile from source':<28} {cold * 1000:8.2f} ms")
+    print(f"{'load from bytecode cache':<28} {warm * 1000:8.2f} ms")
+
+    for name, context in CONTEXTS.items():
+        template = cold_env.get_template(name)
+        before = count / timed(lambda: [template.render(**context) for _ in range(count)])
+
+        after = count / timed(lambda: asyncio.run(render_many(name, [context] * count)))
+        print(f"{name:<28} sync {before:10.0f}/s   async bulk {after:10.0f}/s")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -1,9 +1,154 @@
-import os
+"""
+    the Motor client is built on first use or from the app's lifespan, never
+    at import time, so every gunicorn worker opens its own pool after the
+    fork. modules keep importing `db` as before, it resolves to the live
+    database on each access.
+
+    writes and read-after-write paths use `db`, which always reads from the
+    primary. heavy read-only endpoints use `read_db(router)`, which reads
+    with the router's read preference, secondaryPreferred by default.
+"""
+import asyncio
+import sys
+from typing import Dict, Optional
+
 import motor.motor_asyncio
 from dotenv import load_dotenv
+from pymongo import read_preferences
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+from monitoring import command_monitor, pool_monitor
 
 load_dotenv("../.env")
-#os.environ["MONGODB_URL"]
-client = motor.motor_asyncio.AsyncIOMotorClient(os.environ["MONGODB_URL"])
-db_name = os.environ["MONGODB_DB"]
-db = client[db_name]
+
+
+class DatabaseSettings(BaseSettings):
+    model_config = SettingsConfigDict(env_prefix="MONGODB_", extra="ignore")
+
+    url: str
+    db: str
+    max_pool_size: int = 100
+    min_pool_size: int = 0
+    max_idle_time_ms: int = 60000
+    # fail a request fast instead of queueing behind an exhausted pool
+    wait_queue_timeout_ms: int = 2000
+    server_selection_timeout_ms: int = 5000
+    connect_timeout_ms: int = 5000
+    # the first one the server also supports is used, missing libraries are skipped with a warning
+    compressors: str = "zstd,snappy,zlib"
+    app_name: str = "wenyfour-api"
+
+    # used by read_db() handles, per router overrides go in MONGODB_READ_PREFERENCES
+    # as JSON, e.g. {"transactions": "primary"}
+    read_preference: str = "secondaryPreferred"
+    read_preferences: Dict[str, str] = {}
+    # how far behind the primary a secondary may be and still serve reads, 90 is the server minimum
+    max_staleness_seconds: int = 90
+
+
+READ_MODES = {
+    "primary": read_preferences.Primary,
+    "primaryPreferred": read_preferences.PrimaryPreferred,
+    "secondary": read_preferences.Secondary,
+    "secondaryPreferred": read_preferences.SecondaryPreferred,
+    "nearest": read_preferences.Nearest,
+}
+
+
+_client: Optional[motor.motor_asyncio.AsyncIOMotorClient] = None
+_db: Optional[motor.motor_asyncio.AsyncIOMotorDatabase] = None
+_settings: Optional[DatabaseSettings] = None
+_read_dbs: Dict[str, motor.motor_asyncio.AsyncIOMotorDatabase] = {}
+
+
+def connect(client=None, settings: DatabaseSettings = None) -> motor.motor_asyncio.AsyncIOMotorDatabase:
+    # a client can be passed in, benchmarks use that to run against mongomock
+    global _client, _db, _settings
+    if _db is not None:
+        return _db
+
+    settings = _settings = settings or DatabaseSettings()
+    _client = client or motor.motor_asyncio.AsyncIOMotorClient(
+        settings.url,
+        maxPoolSize=settings.max_pool_size,
+        minPoolSize=settings.min_pool_size,
+        maxIdleTimeMS=settings.max_idle_time_ms,
+        waitQueueTimeoutMS=settings.wait_queue_timeout_ms,
+        serverSelectionTimeoutMS=settings.server_selection_timeout_ms,
+        connectTimeoutMS=settings.connect_timeout_ms,
+        compressors=settings.compressors,
+        appname=settings.app_name,
+        event_listeners=[command_monitor, pool_monitor],
+    )
+    _db = _client[settings.db]
+    return _db
+
+
+def close():
+    global _client, _db
+    if _client is not None:
+        _client.close()
+    _client = None
+    _db = None
+    _read_dbs.clear()
+
+
+def read_preference_for(router: str):
+    mode = _settings.read_preferences.get(router, _settings.read_preference)
+    if mode == "primary":
+        return read_preferences.Primary()
+    return READ_MODES[mode](max_staleness=_settings.max_staleness_seconds)
+
+
+def connect_reads(router: str) -> motor.motor_asyncio.AsyncIOMotorDatabase:
+    connect()
+    if router not in _read_dbs:
+        _read_dbs[router] = _client.get_database(_settings.db, read_preference=read_preference_for(router))
+    return _read_dbs[router]
+
+
+def get_client() -> motor.motor_asyncio.AsyncIOMotorClient:
+    connect()
+    return _client
+
+
+def pool_stats() -> dict:
+    return {"connected": _client is not None, **pool_monitor.stats()}
+
+
+class _Database:
+    # stands in for the AsyncIOMotorDatabase until the client exists
+
+    def __init__(self, router: str = None):
+        self._router = router
+
+    def _resolve(self):
+        return connect() if self._router is None else connect_reads(self._router)
+
+    def __getitem__(self, name: str):
+        return self._resolve()[name]
+
+    def __getattr__(self, name: str):
+        return getattr(self._resolve(), name)
+
+
+db = _Database()
+
+
+def read_db(router: str) -> _Database:
+    # a handle for one router's read-only queries, never use it for writes
+    # or for reads that must see the caller's own write
+    return _Database(router)
+
+
+async def check_reads(routers):
+    # ask the member each router's reads are routed to who it is, handy against a local replica set
+    for router in routers:
+        hello = await connect_reads(router).command("hello", read_preference=read_preference_for(router))
+        print(f"{router:<15}{read_preference_for(router).mongos_mode:<20}{hello.get('me', 'standalone')}")
+    close()
+
+
+if __name__ == "__main__":
+    # python -m database rides transactions
+    asyncio.run(check_reads(sys.argv[1:] or ["rides", "transactions"]))
@@ -0,0 +1,11 @@
+from fastapi import HTTPException, status
+
+driver_not_found_exception = HTTPException(
+    status_code=status.HTTP_404_NOT_FOUND,
+    detail="driver not found"
+)
+
+self_rating_exception = HTTPException(
+    status_code=status.HTTP_400_BAD_REQUEST,
+    detail="drivers can't rate or review themselves"
+)
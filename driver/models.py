@@ -1,17 +1,24 @@
 from pydantic import BaseModel, Field, AnyUrl
-from typing import List
+from typing import Dict, List, Optional
 
 
 class RatingModel(BaseModel):
-    rating: float = Field(...)
-    rater: str = Field(...) # user who provided the rating, this is an objectId field
-    driver_id: str = Field(...)
+    rating: int = Field(..., ge=1, le=5)
+    rater: str = Field(None) # user who provided the rating, this is an objectId field
+    driver_id: str = Field(None)
+
+
+class RatingSummary(BaseModel):
+    count: int = 0
+    sum: int = 0
+    mean: Optional[float] = None
+    histogram: Dict[str, int] = Field(default={})
 
 
 class ReviewModel(BaseModel):
-    review: str = Field(...)
-    reviewer: str = Field(...) # user who provided the review, this is an objectId field
-    driver_id: str = Field(...)
+    review: str = Field(..., min_length=1, max_length=2000)
+    reviewer: str = Field(None) # user who provided the review, this is an objectId field
+    driver_id: str = Field(None)
 
 
 class ReportModel(BaseModel):
@@ -27,8 +34,8 @@ class DriverModel(BaseModel):
     is_verified: bool = False
     user_id: str = Field(None)
 
-    ratings: List[RatingModel] = Field(default=[])
-    reviews: List[ReviewModel] = Field(default=[])
+    # ratings and reviews live in their own collections, the driver only keeps the running totals
+    rating: RatingSummary = Field(default=RatingSummary())
     reports: List[ReportModel] = Field(default=[])
 
     class Config:
@@ -47,8 +54,6 @@ class DriverModel(BaseModel):
                 "driver_licence": self.driver_license.unicode_string(),
                 "user_id": self.user_id,
                 "is_verified": self.is_verified,
-                "ratings": self.ratings,
-                "reviews": self.reviews,
                 "reports": self.reports
                 }
 
@@ -1,13 +1,17 @@
 from fastapi import APIRouter, Depends, Body, HTTPException, status, Request
-from fastapi.responses import Response, JSONResponse
-from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response
 from datetime import datetime, timedelta
 from typing import Annotated
 from bson import ObjectId
+from pymongo import DESCENDING
 
 
-from .models import DriverModel
+from .models import DriverModel, RatingModel, RatingSummary, ReviewModel
+from .exceptions import driver_not_found_exception, self_rating_exception
+from .utils import rate_driver, rating_summary
 from database import db as mongoDB
+from responses import ORJSONResponse
+from pagination import PageParams, paginate, page_response
 from .dependencies import get_token_header, get_current_user_by_jwtoken
 from auth.models import UserModel
 
@@ -43,6 +47,60 @@ async def get_driver_by_id(driver_id:str):
     if driver:
         del driver["_id"]
         driver["id"] = driver_id
-        return JSONResponse(content=driver, status_code=200)
+        driver["rating"] = rating_summary(driver.get("rating"))
+        return ORJSONResponse(content=driver, status_code=200)
     # User not found
     raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Driver with ID {driver_id} not found")
+
+
+async def _rateable_driver(driver_id: str, user: UserModel) -> dict:
+    driver = await mongoDB["drivers"].find_one({"_id": ObjectId(driver_id)}, {"user_id": 1}) if ObjectId.is_valid(driver_id) else None
+    if not driver:
+        raise driver_not_found_exception
+    if driver.get("user_id") == user.id:
+        raise self_rating_exception
+    return driver
+
+
+@router.post("/{driver_id}/ratings", response_description="rate a driver, replacing the caller's earlier rating", response_model=RatingSummary)
+async def rate(driver_id: str, rating: RatingModel, user: Annotated[UserModel, Depends(get_current_user_by_jwtoken)]):
+    await _rateable_driver(driver_id, user)
+
+    summary = await rate_driver(driver_id, user.id, rating.rating)
+    if summary is None:
+        raise driver_not_found_exception
+    return ORJSONResponse(content=summary, status_code=200)
+
+
+@router.get("/{driver_id}/ratings", response_description="a driver's rating count, mean and histogram", response_model=RatingSummary)
+async def get_ratings(driver_id: str):
+    driver = await mongoDB["drivers"].find_one({"_id": ObjectId(driver_id)}, {"rating": 1}) if ObjectId.is_valid(driver_id) else None
+    if not driver:
+        raise driver_not_found_exception
+    return ORJSONResponse(content=rating_summary(driver.get("rating")), status_code=200)
+
+
+@router.post("/{driver_id}/reviews", response_description="review a driver", response_model=ReviewModel)
+async def review(driver_id: str, review: ReviewModel, user: Annotated[UserModel, Depends(get_current_user_by_jwtoken)]):
+    await _rateable_driver(driver_id, user)
+
+    review.driver_id = driver_id
+    review.reviewer = user.id
+    review_data = {**review.model_dump(), "reviewer_name": user.name, "created_at": datetime.now()}
+    result = await mongoDB["driver_reviews"].insert_one(review_data)
+
+    review_data["id"] = str(result.inserted_id)
+    del review_data["_id"]
+    return ORJSONResponse(content=review_data, status_code=201)
+
+
+@router.get("/{driver_id}/reviews", response_description="a driver's reviews, newest first")
+async def get_reviews(driver_id: str, page: Annotated[PageParams, Depends()]):
+    reviews, next_cursor = await paginate(
+        mongoDB["driver_reviews"], {"driver_id": driver_id}, direction=DESCENDING, cursor=page.cursor, limit=page.limit,
+    )
+    for review in reviews:
+        review["id"] = str(review["_id"])
+        del review["_id"]
+
+    return page_response(reviews, next_cursor)
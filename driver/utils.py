@@ -0,0 +1,134 @@
+from datetime import datetime
+from typing import Optional
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from database import db as mongoDB
+
+
+STARS = ("1", "2", "3", "4", "5")
+
+
+def rating_summary(rating: Optional[dict]) -> dict:
+    # the driver document keeps count, sum and histogram, the mean is derived from them
+    rating = rating or {}
+    count, total = rating.get("count", 0), rating.get("sum", 0)
+    histogram = rating.get("histogram", {})
+    return {
+        "count": count,
+        "sum": total,
+        "mean": round(total / count, 2) if count else None,
+        "histogram": {star: histogram.get(star, 0) for star in STARS},
+    }
+
+
+async def rate_driver(driver_id: str, rater: str, stars: int) -> Optional[dict]:
+    """
+        store `rater`'s rating of the driver, replacing any earlier one, and
+        move the driver's running totals by the difference. returns the new
+        summary, or None if there is no such driver.
+    """
+    now = datetime.now()
+    try:
+        previous = await mongoDB["driver_ratings"].find_one_and_update(
+            {"driver_id": driver_id, "rater": rater},
+            {"$set": {"rating": stars, "updated_at": now}, "$setOnInsert": {"created_at": now}},
+            projection={"rating": 1},
+            upsert=True,
+            return_document=ReturnDocument.BEFORE,
+        )
+    except DuplicateKeyError:
+        # lost an upsert race against the same rater, the rating exists now so this is an update
+        return await rate_driver(driver_id, rater, stars)
+
+    if previous is None:
+        inc = {"rating.count": 1, "rating.sum": stars, f"rating.histogram.{stars}": 1}
+    elif previous["rating"] != stars:
+        inc = {"rating.sum": stars - previous["rating"], f"rating.histogram.{previous['rating']}": -1, f"rating.histogram.{stars}": 1}
+    else:
+        inc = {}
+
+    if inc:
+        driver = await _inc_totals(driver_id, inc)
+    else:
+        driver = await mongoDB["drivers"].find_one({"_id": ObjectId(driver_id)}, {"rating": 1})
+    return rating_summary(driver.get("rating")) if driver else None
+
+
+async def _inc_totals(driver_id: str, inc: dict) -> Optional[dict]:
+    # every change bumps the version, which orders the copies made on the user
+    driver = await mongoDB["drivers"].find_one_and_update(
+        {"_id": ObjectId(driver_id)}, {"$inc": {**inc, "rating.version": 1}},
+        projection={"rating": 1, "user_id": 1}, return_document=ReturnDocument.AFTER,
+    )
+    if driver:
+        await mirror_ratings(driver)
+    return driver
+
+
+async def mirror_ratings(driver: dict):
+    # ride pages already read the driver's user, a copy there saves them a lookup.
+    # a copy only replaces an older one, so concurrent ratings can land in any order
+    rating = driver.get("rating") or {}
+    if not ObjectId.is_valid(driver.get("user_id")):
+        return
+    await mongoDB["users"].update_one(
+        {"_id": ObjectId(driver["user_id"]), "$or": [
+            {"driver_rating.version": {"$exists": False}},
+            {"driver_rating.version": {"$lt": rating.get("version", 0)}},
+        ]},
+        {"$set": {"driver_rating": rating}},
+    )
+
+
+async def backfill_user_ratings():
+    # drivers rated before the totals were versioned and copied onto their user. each is
+    # claimed by setting the version, so this runs once per driver and never touches the
+    # totals; a driver rated in the meantime was versioned and copied by rate_driver
+    async for driver in mongoDB["drivers"].find({"rating": {"$exists": True}, "rating.version": {"$exists": False}}, {"_id": 1}):
+        driver = await mongoDB["drivers"].find_one_and_update(
+            {"_id": driver["_id"], "rating.version": {"$exists": False}},
+            {"$set": {"rating.version": 0}},
+            projection={"rating": 1, "user_id": 1}, return_document=ReturnDocument.AFTER,
+        )
+        if driver:
+            await mirror_ratings(driver)
+
+
+async def move_embedded_ratings():
+    # drivers created before ratings had their own collection carry them as arrays.
+    # every worker runs this at startup, so each driver is claimed by unsetting the
+    # arrays atomically and only the worker whose update returned them copies them
+    while True:
+        driver = await mongoDB["drivers"].find_one_and_update(
+            {"$or": [{"ratings": {"$exists": True}}, {"reviews": {"$exists": True}}]},
+            {"$unset": {"ratings": "", "reviews": ""}},
+            projection={"ratings": 1, "reviews": 1},
+        )
+        if driver is None:
+            break
+
+        driver_id = str(driver["_id"])
+        # only ratings this copy inserted count, the totals may already be moving with live ones
+        inc = {}
+        for rating in driver.get("ratings") or []:
+            stars = min(5, max(1, round(rating["rating"])))
+            result = await mongoDB["driver_ratings"].update_one(
+                {"driver_id": driver_id, "rater": rating["rater"]},
+                {"$setOnInsert": {"rating": stars, "created_at": datetime.now()}},
+                upsert=True,
+            )
+            if result.upserted_id is not None:
+                for key, value in (("rating.count", 1), ("rating.sum", stars), (f"rating.histogram.{stars}", 1)):
+                    inc[key] = inc.get(key, 0) + value
+        if inc:
+            await _inc_totals(driver_id, inc)
+
+        reviews = [
+            {"driver_id": driver_id, "reviewer": review["reviewer"], "review": review["review"], "created_at": datetime.now()}
+            for review in driver.get("reviews") or []
+        ]
+        if reviews:
+            await mongoDB["driver_reviews"].insert_many(reviews)
@@ -1,17 +1,54 @@
-from fastapi import FastAPI, Request
+from fastapi import Depends, FastAPI, Request
+from fastapi.responses import PlainTextResponse
+from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from auth.router import router as auth_routers
 from cars.routers import router as car_routers
 from rides.router import router as ride_routers
 from transactions.routers import router as transaction_routers
+from driver.router import router as driver_routers
+from auth.mailer import mail_dispatcher
+from auth.pictures import shutdown_pictures, PICTURE_STORAGE, PICTURE_LOCAL_DIR
+from templating import precompile_templates
+from schema import ensure_schema
+from rides.expiry import ride_expiry_scheduler, RIDE_EXPIRY_IN_APP
+from rides.locations import location_index_refresher
+from rides.live import router as live_routers, seat_feed, LIVE_SEATS_ENABLED
+from responses import ORJSONResponse
+from metrics import http_request_duration, http_requests_in_flight, render_metrics, require_metrics_token
+from monitoring import command_monitor, track_request, finish_request
+import database
 
+from contextlib import asynccontextmanager
+import asyncio
 import time
-import random
-import string
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # the client is created here, inside the worker, so no pool is ever shared across a fork
+    database.connect()
+    precompile_templates()
+    # index builds and migrations run in the background, requests are served meanwhile
+    schema_task = asyncio.create_task(ensure_schema())
+    location_index_refresher.start(after=schema_task)
+    await mail_dispatcher.start()
+    if RIDE_EXPIRY_IN_APP:
+        ride_expiry_scheduler.start()
+    if LIVE_SEATS_ENABLED:
+        seat_feed.start()
+    yield
+    await seat_feed.stop()
+    await ride_expiry_scheduler.stop()
+    await location_index_refresher.stop()
+    await mail_dispatcher.stop()
+    shutdown_pictures()
+    schema_task.cancel()
+    await asyncio.gather(schema_task, return_exceptions=True)
+    database.close()
 
-app = FastAPI()
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -21,22 +58,60 @@ app.add_middleware(
 
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
-    idem = ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
-    #logger.info(f"rid={idem} start request path={request.url.path}")
-    start_time = time.time()
-    
-    response = await call_next(request)
-    
-    process_time = (time.time() - start_time)
+    start_time = time.perf_counter()
+    http_requests_in_flight.inc()
+    db_stats = track_request(request.scope)
+    status_code = 500
+
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+    finally:
+        process_time = time.perf_counter() - start_time
+        http_requests_in_flight.dec()
+
+        # label by the matched route template, raw paths would explode the series count
+        route = request.scope.get("route")
+        http_request_duration.observe(
+            process_time,
+            method=request.method,
+            route=getattr(route, "path", "unmatched"),
+            status=status_code,
+        )
+        finish_request(db_stats)
+
     response.headers["X-Process-Time"] = str(process_time)
-    #formatted_process_time = '{0:.2f}'.format(process_time)
-    #logger.info("returning response")
+    response.headers["X-DB-Round-Trips"] = str(db_stats.round_trips)
     return response
 
 app.include_router(auth_routers)
 app.include_router(car_routers)
 app.include_router(ride_routers)
 app.include_router(transaction_routers)
+app.include_router(driver_routers)
+app.include_router(live_routers)
+
+if PICTURE_STORAGE == "local":
+    app.mount("/media", StaticFiles(directory=PICTURE_LOCAL_DIR, check_dir=False), name="media")
+
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/metrics/pool", include_in_schema=False, dependencies=[Depends(require_metrics_token)])
+def pool_stats():
+    return database.pool_stats()
+
+
+@app.get("/metrics/queries", include_in_schema=False, dependencies=[Depends(require_metrics_token)])
+def query_shapes(limit: int = 50, reset: bool = False):
+    # slowest query shapes by total time, a high count on one shape usually means an N+1 loop
+    shapes = command_monitor.shapes(limit)
+    if reset:
+        command_monitor.reset()
+    return shapes
 
 
 @app.get("/api/")
@@ -0,0 +1,174 @@
+"""
+    in-process metrics rendered in the Prometheus text format on /metrics.
+
+    every metric keeps at most METRICS_MAX_SERIES label sets; observations for
+    label sets beyond that are folded into a single "overflow" series so a
+    burst of odd paths or statuses can't grow memory without bound.
+
+    /metrics itself is open to the scraper; the detail endpoints (pool
+    state, query shapes) need the METRICS_TOKEN in an x-metrics-token
+    header and are off while it isn't set.
+"""
+import os
+import secrets
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Tuple
+
+from fastapi import Header, HTTPException, status
+
+
+METRICS_MAX_SERIES = int(os.environ.get("METRICS_MAX_SERIES", 500))
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+OVERFLOW = "overflow"
+
+# request latency buckets in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series: Dict[Tuple[str, ...], object] = {}
+        REGISTRY.append(self)
+
+    def _key(self, labels: dict) -> Tuple[str, ...]:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        if key not in self._series and len(self._series) >= METRICS_MAX_SERIES:
+            return tuple(OVERFLOW for _ in self.labelnames)
+        return key
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._series[key] = self._series.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for key, value in self._series.items():
+            lines.append(f"{self.name}{_labels(self.labelnames, key)} {_format(value)}")
+        return lines
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        self._series[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._series[key] = self._series.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    render = Counter.render
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        series = self._series.get(key)
+        if series is None:
+            # per-bucket counts, then sum and count
+            series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for key, (counts, total, count) in self._series.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = 'le="%s"' % _format(bound)
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_format(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+REGISTRY: List[_Metric] = []
+
+# callables run at scrape time to refresh gauges owned by other modules
+COLLECTORS: List[Callable[[], None]] = []
+
+
+def register_stats(name: str, documentation: str, stats: Callable[[], dict]) -> Gauge:
+    # expose a module's stats dict as one gauge labelled by stat
+    gauge = Gauge(name, documentation, ("stat",))
+
+    def collect():
+        for stat, value in stats().items():
+            gauge.set(value, stat=stat)
+
+    COLLECTORS.append(collect)
+    return gauge
+
+
+def render_metrics() -> str:
+    for collect in COLLECTORS:
+        collect()
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+metrics_token_exception = HTTPException(
+    status_code=status.HTTP_403_FORBIDDEN,
+    detail="a valid x-metrics-token header is required",
+)
+
+
+def require_metrics_token(x_metrics_token: Optional[str] = Header(None)):
+    if not METRICS_TOKEN or not x_metrics_token or not secrets.compare_digest(x_metrics_token, METRICS_TOKEN):
+        raise metrics_token_exception
+
+
+http_request_duration = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template.", ("method", "route", "status"),
+)
+http_requests_in_flight = Gauge(
+    "http_requests_in_flight", "HTTP requests currently being served.",
+)
+auth_failures = Counter(
+    "auth_failures_total", "Rejected logins and tokens.", ("reason",),
+)
+ride_bookings = Counter(
+    "ride_bookings_total", "Ride booking attempts by outcome.", ("outcome",),
+)
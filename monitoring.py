@@ -0,0 +1,231 @@
+"""
+    MongoDB command monitoring.
+
+    every command the driver sends is timed and aggregated by collection,
+    command and normalized query shape (values replaced by "?"), so N+1
+    patterns show up as one shape with a very high count. commands slower
+    than MONGO_SLOW_QUERY_MS are logged with the route that issued them, and
+    each request counts its database round trips.
+"""
+import contextvars
+import os
+import threading
+from typing import Optional
+
+from pymongo import monitoring
+
+from metrics import Histogram, register_stats
+
+
+MONGO_SLOW_QUERY_MS = float(os.environ.get("MONGO_SLOW_QUERY_MS", 100))
+MAX_QUERY_SHAPES = int(os.environ.get("MONGO_MAX_QUERY_SHAPES", 1000))
+
+# where each command keeps the filter that decides its shape
+_FILTER_FIELDS = {
+    "find": "filter",
+    "count": "query",
+    "distinct": "query",
+    "findAndModify": "query",
+    "aggregate": "pipeline",
+}
+_BULK_FIELDS = {"update": "updates", "delete": "deletes"}
+_IGNORED_COMMANDS = {"hello", "isMaster", "ismaster", "ping", "endSessions", "saslStart", "saslContinue", "buildInfo"}
+
+
+db_round_trips = Histogram(
+    "db_round_trips_per_request", "MongoDB commands issued per HTTP request.", ("route",),
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 50, 100),
+)
+
+
+class RequestStats:
+
+    def __init__(self, scope: dict):
+        self.scope = scope
+        self.round_trips = 0
+        self.db_ms = 0.0
+
+    @property
+    def route(self) -> str:
+        route = self.scope.get("route")
+        return getattr(route, "path", self.scope.get("path", "unknown"))
+
+
+_current_request: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar("current_request", default=None)
+
+
+def track_request(scope: dict) -> RequestStats:
+    # Motor copies the context into its executor threads, so the listener sees this
+    stats = RequestStats(scope)
+    _current_request.set(stats)
+    return stats
+
+
+def finish_request(stats: RequestStats):
+    db_round_trips.observe(stats.round_trips, route=stats.route)
+
+
+def query_shape(value):
+    if isinstance(value, dict):
+        return {key: query_shape(val) for key, val in value.items()}
+    if isinstance(value, (list, tuple)):
+        # keep pipelines and $and/$or branches, collapse value lists like $in
+        if value and all(isinstance(item, dict) for item in value):
+            return [query_shape(item) for item in value]
+        return ["?"]
+    return "?"
+
+
+def command_shape(command_name: str, command: dict) -> str:
+    if command_name in _FILTER_FIELDS:
+        return repr(query_shape(command.get(_FILTER_FIELDS[command_name], {})))
+    if command_name in _BULK_FIELDS:
+        statements = command.get(_BULK_FIELDS[command_name]) or [{}]
+        return repr(query_shape(statements[0].get("q", {})))
+    return ""
+
+
+def command_collection(command_name: str, command: dict) -> str:
+    if command_name == "getMore":
+        return command.get("collection", "")
+    value = command.get(command_name)
+    return value if isinstance(value, str) else ""
+
+
+class CommandMonitor(monitoring.CommandListener):
+
+    def __init__(self, slow_ms: float = MONGO_SLOW_QUERY_MS, max_shapes: int = MAX_QUERY_SHAPES):
+        self.slow_ms = slow_ms
+        self.max_shapes = max_shapes
+        self._pending = {}
+        self._shapes = {}
+        self._lock = threading.Lock()
+
+    def started(self, event: monitoring.CommandStartedEvent):
+        if event.command_name in _IGNORED_COMMANDS:
+            return
+
+        request = _current_request.get()
+        if request is not None:
+            request.round_trips += 1
+
+        key = (event.connection_id, event.request_id)
+        self._pending[key] = (
+            command_collection(event.command_name, event.command),
+            command_shape(event.command_name, event.command),
+            request,
+        )
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent):
+        self._finish(event, failed=False)
+
+    def failed(self, event: monitoring.CommandFailedEvent):
+        self._finish(event, failed=True)
+
+    def _finish(self, event, failed: bool):
+        pending = self._pending.pop((event.connection_id, event.request_id), None)
+        if pending is None:
+            return
+
+        collection, shape, request = pending
+        duration_ms = event.duration_micros / 1000
+        if request is not None:
+            request.db_ms += duration_ms
+
+        key = (collection, event.command_name, shape)
+        with self._lock:
+            if key not in self._shapes and len(self._shapes) >= self.max_shapes:
+                key = (collection, event.command_name, "overflow")
+            entry = self._shapes.setdefault(key, {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "failures": 0})
+            entry["count"] += 1
+            entry["total_ms"] += duration_ms
+            entry["max_ms"] = max(entry["max_ms"], duration_ms)
+            entry["failures"] += failed
+
+        if duration_ms >= self.slow_ms:
+            route = request.route if request is not None else "background"
+            print(f"slow mongo command {event.command_name} on {collection} took {duration_ms:.1f}ms route={route} shape={shape}")
+
+    def shapes(self, limit: int = 50) -> list:
+        with self._lock:
+            rows = [
+                {"collection": collection, "command": command, "shape": shape, **entry}
+                for (collection, command, shape), entry in self._shapes.items()
+            ]
+        rows.sort(key=lambda row: row["total_ms"], reverse=True)
+        return rows[:limit]
+
+    def reset(self):
+        with self._lock:
+            self._shapes.clear()
+
+
+command_monitor = CommandMonitor()
+
+
+class PoolMonitor(monitoring.ConnectionPoolListener):
+    """
+        live connection pool counters across every server the client talks
+        to. checkout failures are mostly wait queue timeouts, a steady rise
+        means the pool is too small for the request concurrency.
+    """
+
+    def __init__(self):
+        self.counters = {
+            "open": 0,
+            "checked_out": 0,
+            "waiting": 0,
+            "created_total": 0,
+            "closed_total": 0,
+            "checkouts_total": 0,
+            "checkout_failures_total": 0,
+            "pool_clears_total": 0,
+        }
+        self._lock = threading.Lock()
+
+    def _add(self, **deltas):
+        with self._lock:
+            for name, delta in deltas.items():
+                self.counters[name] += delta
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._add(pool_clears_total=1)
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._add(open=1, created_total=1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._add(open=-1, closed_total=1)
+
+    def connection_check_out_started(self, event):
+        self._add(waiting=1)
+
+    def connection_check_out_failed(self, event):
+        self._add(waiting=-1, checkout_failures_total=1)
+
+    def connection_checked_out(self, event):
+        self._add(waiting=-1, checked_out=1, checkouts_total=1)
+
+    def connection_checked_in(self, event):
+        self._add(checked_out=-1)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self.counters)
+
+
+pool_monitor = PoolMonitor()
+
+register_stats("mongo_pool", "MongoDB connection pool counters.", pool_monitor.stats)
@@ -0,0 +1,87 @@
+import base64
+from typing import Annotated, List, Optional, Tuple
+
+from bson import json_util
+from fastapi import HTTPException, Query, status
+from pymongo import ASCENDING
+
+from responses import ORJSONResponse
+
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+invalid_cursor_exception = HTTPException(
+    status_code=status.HTTP_400_BAD_REQUEST,
+    detail="invalid cursor"
+)
+
+
+class PageParams:
+    # query parameters shared by every paginated list endpoint
+    def __init__(
+        self,
+        cursor: str = None,
+        limit: Annotated[int, Query(gt=0, le=MAX_PAGE_SIZE)] = DEFAULT_PAGE_SIZE,
+    ):
+        self.cursor = cursor
+        self.limit = limit
+
+
+def encode_cursor(sort_value, doc_id) -> str:
+    raw = json_util.dumps([sort_value, doc_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str, sort_type=None) -> Tuple:
+    # sort_type rejects a cursor from a differently sorted listing, e.g. a geo search page
+    try:
+        sort_value, doc_id = json_util.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except Exception:
+        raise invalid_cursor_exception
+    if sort_type is not None and (not isinstance(sort_value, sort_type) or isinstance(sort_value, bool)):
+        raise invalid_cursor_exception
+    return sort_value, doc_id
+
+
+def after_cursor(sort_key: str, sort_value, doc_id, direction: int = ASCENDING) -> dict:
+    # keyset condition for documents sorted by (sort_key, _id) in either direction
+    op = "$gt" if direction == ASCENDING else "$lt"
+    if sort_key == "_id":
+        return {"_id": {op: doc_id}}
+    return {
+        "$or": [
+            {sort_key: {op: sort_value}},
+            {sort_key: sort_value, "_id": {op: doc_id}},
+        ]
+    }
+
+
+def page_cursor(collection, query: dict, projection: dict = None, sort_key: str = "_id",
+                direction: int = ASCENDING, cursor: str = None, limit: int = DEFAULT_PAGE_SIZE):
+    if cursor:
+        query = {"$and": [query, after_cursor(sort_key, *decode_cursor(cursor), direction=direction)]}
+
+    sort = [("_id", direction)] if sort_key == "_id" else [(sort_key, direction), ("_id", direction)]
+    return collection.find(query, projection).sort(sort).limit(limit)
+
+
+async def paginate(collection, query: dict, projection: dict = None, sort_key: str = "_id",
+                   direction: int = ASCENDING, cursor: str = None, limit: int = DEFAULT_PAGE_SIZE) -> Tuple[List[dict], Optional[str]]:
+    """
+        fetch one page of `query` ordered by (sort_key, _id). returns the
+        documents and the cursor for the next page, or None on the last page.
+    """
+    docs = await page_cursor(collection, query, projection, sort_key, direction, cursor, limit).to_list(length=limit)
+
+    next_cursor = None
+    if len(docs) == limit and docs[-1].get(sort_key) is not None:
+        next_cursor = encode_cursor(docs[-1][sort_key], docs[-1]["_id"])
+    return docs, next_cursor
+
+
+def page_response(content: list, next_cursor: Optional[str]) -> ORJSONResponse:
+    headers = {NEXT_CURSOR_HEADER: next_cursor} if next_cursor else {}
+    return ORJSONResponse(status_code=status.HTTP_200_OK, content=content, headers=headers)
@@ -0,0 +1,33 @@
+from decimal import Decimal
+from typing import Any
+
+import orjson
+from bson import ObjectId, Decimal128
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+from pydantic_core import Url
+
+
+def bson_default(obj: Any):
+    # orjson already handles datetime, date, time and UUID natively
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, BaseModel):
+        return obj.model_dump()
+    if isinstance(obj, (Url, Decimal, Decimal128)):
+        return str(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    return orjson.dumps(content, default=bson_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+class ORJSONResponse(JSONResponse):
+    """
+        JSON response rendered in a single orjson pass, takes pydantic models and
+        raw Mongo documents as they are.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
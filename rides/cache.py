@@ -0,0 +1,145 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Hashable, Optional
+
+from metrics import register_stats
+
+
+SEARCH_CACHE_SIZE = int(os.environ.get("SEARCH_CACHE_SIZE", 1024))
+SEARCH_CACHE_TTL = float(os.environ.get("SEARCH_CACHE_TTL", 5))
+# rides kept per cached search, pages past this many fall through to the database
+SEARCH_CACHE_MAX_RIDES = int(os.environ.get("SEARCH_CACHE_MAX_RIDES", 200))
+
+
+class SingleFlight:
+    """
+        collapses concurrent calls for the same key into one: the first caller
+        starts `load` in its own task, everyone arriving while it runs awaits
+        the same result. a caller that is cancelled (its client went away)
+        only stops waiting, the load carries on for the others.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self.shared = 0
+
+    def _done(self, key: Hashable, task: asyncio.Future):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # every waiter may be gone, don't let the loop complain about an unread error
+        if not task.cancelled():
+            task.exception()
+
+    async def do(self, key: Hashable, load: Callable[[], Awaitable]):
+        task = self._calls.get(key)
+        if task is not None:
+            self.shared += 1
+        else:
+            task = asyncio.ensure_future(load())
+            self._calls[key] = task
+            task.add_done_callback(lambda task: self._done(key, task))
+        return await asyncio.shield(task)
+
+
+class SearchCache:
+    """
+        LRU of ride search results keyed by (from, to, seats, time bucket),
+        each entry living at most `ttl` seconds. entries are caller
+        independent, per caller filtering happens after the lookup. a write
+        to a route drops every entry for it and, while loads for the route
+        are running, bumps its generation so one that started before the
+        write can't store stale rides. generations are only kept for routes
+        with loads in flight.
+    """
+
+    def __init__(self, maxsize: int = SEARCH_CACHE_SIZE, ttl: float = SEARCH_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._generations = {}
+        self._loading = {}
+        self._flight = SingleFlight()
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def key(self, from_location: str, to_location: str, seats: int, now: float = None) -> tuple:
+        bucket = int((now or time.time()) // self.ttl) if self.ttl else 0
+        return (from_location.strip().lower(), to_location.strip().lower(), seats, bucket)
+
+    def get(self, key: tuple) -> Optional[object]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: tuple, value, generation: int):
+        if self._generations.get(key[:2], 0) != generation:
+            return
+
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    async def get_or_load(self, key: tuple, load: Callable[[], Awaitable]):
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        self.misses += 1
+        route = key[:2]
+
+        async def load_and_store():
+            self._loading[route] = self._loading.get(route, 0) + 1
+            generation = self._generations.get(route, 0)
+            try:
+                value = await load()
+                self.set(key, value, generation)
+                return value
+            finally:
+                self._loading[route] -= 1
+                if not self._loading[route]:
+                    # nothing left that could store a stale result
+                    del self._loading[route]
+                    self._generations.pop(route, None)
+
+        return await self._flight.do(key, load_and_store)
+
+    def invalidate(self, from_location: str, to_location: str):
+        route = (from_location.strip().lower(), to_location.strip().lower())
+        if route in self._loading:
+            self._generations[route] = self._generations.get(route, 0) + 1
+        for key in [key for key in self._entries if key[:2] == route]:
+            del self._entries[key]
+        self.invalidations += 1
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self._flight.shared,
+            "invalidations": self.invalidations,
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+        }
+
+
+search_cache = SearchCache()
+ride_lookups = SingleFlight()
+
+register_stats("ride_search_cache", "Ride search cache counters.", search_cache.stats)
@@ -0,0 +1,74 @@
+"""
+    marks rides whose departure has passed as expired.
+
+    runs inside the app from its lifespan, or on its own as a worker:
+
+        python -m rides.expiry
+"""
+import asyncio
+import os
+from datetime import datetime
+
+from database import db as mongoDB
+
+
+RIDE_EXPIRY_INTERVAL = float(os.environ.get("RIDE_EXPIRY_INTERVAL", 60))
+RIDE_EXPIRY_BATCH_SIZE = int(os.environ.get("RIDE_EXPIRY_BATCH_SIZE", 1000))
+# set to false when the sweeper runs as a separate worker
+RIDE_EXPIRY_IN_APP = os.environ.get("RIDE_EXPIRY_IN_APP", "true").lower() == "true"
+
+
+async def expire_rides(now: datetime = None, batch_size: int = RIDE_EXPIRY_BATCH_SIZE) -> int:
+    now = now or datetime.now()
+    expired = 0
+
+    # walk the ride_expiry index in bounded batches so one sweep never holds a huge update
+    while True:
+        ride_ids = [
+            ride["_id"]
+            async for ride in mongoDB["rides"].find({"expired": False, "departure": {"$lte": now}}, {"_id": 1}).limit(batch_size)
+        ]
+        if not ride_ids:
+            break
+
+        res = await mongoDB["rides"].update_many({"_id": {"$in": ride_ids}, "expired": False}, {"$set": {"expired": True}})
+        expired += res.modified_count
+
+        if len(ride_ids) < batch_size:
+            break
+    return expired
+
+
+class RideExpiryScheduler:
+
+    def __init__(self, interval: float = RIDE_EXPIRY_INTERVAL):
+        self.interval = interval
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def run(self):
+        while True:
+            try:
+                expired = await expire_rides()
+                if expired:
+                    print(f"expired {expired} rides")
+            except asyncio.CancelledError:
+                raise
+            except Exception as err:
+                print(err, )
+            await asyncio.sleep(self.interval)
+
+
+ride_expiry_scheduler = RideExpiryScheduler()
+
+
+if __name__ == "__main__":
+    asyncio.run(ride_expiry_scheduler.run())
@@ -0,0 +1,341 @@
+"""
+    live seat availability over WebSockets.
+
+    one change stream per process watches `rides` for seat and expiry changes
+    and fans them out to the sockets subscribed to that ride or route. each
+    socket gets a bounded queue; a client that falls LIVE_QUEUE_SIZE messages
+    behind is disconnected rather than buffered without limit, and can
+    reconnect and resubscribe. change streams need a replica set, on a
+    standalone server the watcher keeps retrying and sockets stay quiet.
+    deletes are routed from the pre-image when the collection records them
+    (MongoDB 6.0+, switched on by `python -m schema build`), otherwise from
+    the routes of rides this worker has seen change.
+
+    protocol, JSON text frames:
+
+        -> {"subscribe": {"ride": "<ride id>"}}
+        -> {"subscribe": {"route": {"from": "kano", "to": "abuja"}}}
+        -> {"unsubscribe": ...same as subscribe...}
+        <- {"ride_id": ..., "from_location": ..., "to_location": ...,
+            "available_seats": ..., "expired": ..., "event": "snapshot|insert|update|delete"}
+"""
+import asyncio
+import os
+from collections import OrderedDict
+from typing import Dict, Optional, Set
+
+from bson import ObjectId
+from fastapi import APIRouter, HTTPException, Query, WebSocket, WebSocketDisconnect, status
+from pymongo.errors import PyMongoError
+
+from auth.utils import get_current_user
+from database import db as mongoDB
+from metrics import register_stats
+from responses import dumps
+from .cache import search_cache
+from .locations import canonical_location
+
+
+LIVE_SEATS_ENABLED = os.environ.get("LIVE_SEATS_ENABLED", "true").lower() == "true"
+LIVE_QUEUE_SIZE = int(os.environ.get("LIVE_QUEUE_SIZE", 64))
+LIVE_MAX_SUBSCRIPTIONS = int(os.environ.get("LIVE_MAX_SUBSCRIPTIONS", 50))
+LIVE_RETRY_SECONDS = float(os.environ.get("LIVE_RETRY_SECONDS", 5))
+# ride id -> route for routing deletes when there is no pre-image
+LIVE_ROUTE_MEMORY = int(os.environ.get("LIVE_ROUTE_MEMORY", 10000))
+
+# policy violation is the closest standard code to "you were too slow"
+SLOW_CONSUMER_CLOSE_CODE = status.WS_1008_POLICY_VIOLATION
+
+# only changes that move seats or expiry, trimmed to the fields subscribers get
+CHANGE_PIPELINE = [
+    {"$match": {"$or": [
+        {"operationType": {"$in": ["insert", "replace", "delete"]}},
+        {"updateDescription.updatedFields.available_seats": {"$exists": True}},
+        {"updateDescription.updatedFields.expired": {"$exists": True}},
+    ]}},
+    {"$project": {
+        "operationType": 1,
+        "documentKey": 1,
+        "fullDocument.from_location": 1,
+        "fullDocument.to_location": 1,
+        "fullDocument.available_seats": 1,
+        "fullDocument.expired": 1,
+        "fullDocumentBeforeChange.from_location": 1,
+        "fullDocumentBeforeChange.to_location": 1,
+    }},
+]
+
+
+def ride_topic(ride_id: str) -> str:
+    return f"ride:{ride_id}"
+
+
+def route_topic(from_location: str, to_location: str) -> str:
+    return f"route:{canonical_location(from_location)}|{canonical_location(to_location)}"
+
+
+class Subscriber:
+
+    def __init__(self, maxsize: int = LIVE_QUEUE_SIZE):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.topics: Set[str] = set()
+        self.evicted = asyncio.Event()
+
+
+class SeatFeed:
+
+    def __init__(self):
+        self._topics: Dict[str, Set[Subscriber]] = {}
+        # messages published per topic, lets a snapshot tell it was overtaken
+        self._sequence: Dict[str, int] = {}
+        self._routes: "OrderedDict[str, tuple]" = OrderedDict()
+        self._task: Optional[asyncio.Task] = None
+        self._resume_token = None
+
+        self.connections = 0
+        self.published = 0
+        self.evictions = 0
+        self.stream_errors = 0
+
+    # subscriptions
+
+    def subscribe(self, subscriber: Subscriber, topic: str) -> bool:
+        if topic not in subscriber.topics and len(subscriber.topics) >= LIVE_MAX_SUBSCRIPTIONS:
+            return False
+        subscriber.topics.add(topic)
+        self._topics.setdefault(topic, set()).add(subscriber)
+        self._sequence.setdefault(topic, 0)
+        return True
+
+    def sequence(self, topic: str) -> int:
+        return self._sequence.get(topic, 0)
+
+    def unsubscribe(self, subscriber: Subscriber, topic: str):
+        subscriber.topics.discard(topic)
+        subscribers = self._topics.get(topic)
+        if subscribers is not None:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self._topics[topic]
+                del self._sequence[topic]
+
+    def remove(self, subscriber: Subscriber):
+        for topic in list(subscriber.topics):
+            self.unsubscribe(subscriber, topic)
+
+    def deliver(self, subscriber: Subscriber, message: bytes):
+        try:
+            subscriber.queue.put_nowait(message)
+            self.published += 1
+        except asyncio.QueueFull:
+            # drop the slow client instead of letting its queue grow
+            self.evictions += 1
+            self.remove(subscriber)
+            subscriber.evicted.set()
+
+    def publish(self, topics, message: bytes):
+        # a socket following both the ride and its route gets the change once
+        subscribers = set()
+        for topic in topics:
+            if topic in self._topics:
+                self._sequence[topic] += 1
+                subscribers.update(self._topics[topic])
+        for subscriber in subscribers:
+            self.deliver(subscriber, message)
+
+    def _route(self, ride_id: str, change: dict) -> Optional[tuple]:
+        for image in (change.get("fullDocument"), change.get("fullDocumentBeforeChange")):
+            if image and image.get("from_location") and image.get("to_location"):
+                route = (image["from_location"], image["to_location"])
+                break
+        else:
+            route = self._routes.get(ride_id)
+
+        if change["operationType"] == "delete":
+            self._routes.pop(ride_id, None)
+        elif route:
+            self._routes[ride_id] = route
+            self._routes.move_to_end(ride_id)
+            while len(self._routes) > LIVE_ROUTE_MEMORY:
+                self._routes.popitem(last=False)
+        return route
+
+    # change stream
+
+    def handle_change(self, change: dict):
+        ride_id = str(change["documentKey"]["_id"])
+        ride = change.get("fullDocument") or {}
+        route = self._route(ride_id, change)
+        message = {
+            "ride_id": ride_id,
+            "from_location": route[0] if route else None,
+            "to_location": route[1] if route else None,
+            "available_seats": ride.get("available_seats"),
+            "expired": ride.get("expired"),
+            "event": change["operationType"],
+        }
+
+        topics = [ride_topic(ride_id)]
+        if route:
+            topics.append(route_topic(*route))
+            # the same stream keeps this worker's search cache in step with writes made by other workers
+            search_cache.invalidate(*route)
+        self.publish(topics, dumps(message))
+
+    async def _pre_images_enabled(self) -> bool:
+        # only read here, the option is set by `python -m schema build`
+        collections = await mongoDB.list_collections(filter={"name": "rides"})
+        options = (await collections.to_list(length=1) or [{}])[0].get("options", {})
+        return bool(options.get("changeStreamPreAndPostImages", {}).get("enabled"))
+
+    async def watch(self):
+        while True:
+            try:
+                # checked on every (re)connect, so a build run later is picked up
+                pre_images = await self._pre_images_enabled()
+                # older servers reject the option outright
+                options = {"full_document_before_change": "whenAvailable"} if pre_images else {}
+                async with mongoDB["rides"].watch(
+                    CHANGE_PIPELINE, full_document="updateLookup", resume_after=self._resume_token, **options,
+                ) as stream:
+                    async for change in stream:
+                        self._resume_token = stream.resume_token
+                        self.handle_change(change)
+            except asyncio.CancelledError:
+                raise
+            except PyMongoError as err:
+                self.stream_errors += 1
+                print(err, )
+                # a token the server no longer has would fail forever
+                if "resume" in str(err).lower():
+                    self._resume_token = None
+            except Exception as err:
+                self.stream_errors += 1
+                print(err, )
+            await asyncio.sleep(LIVE_RETRY_SECONDS)
+
+    def start(self):
+        self._task = asyncio.create_task(self.watch())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "connections": self.connections,
+            "topics": len(self._topics),
+            "published": self.published,
+            "evictions": self.evictions,
+            "stream_errors": self.stream_errors,
+            "watching": int(self._task is not None and not self._task.done()),
+        }
+
+
+seat_feed = SeatFeed()
+
+register_stats("live_seats", "Live seat WebSocket connections and fan-out.", seat_feed.stats)
+
+
+router = APIRouter(
+    prefix="/api/live",
+    tags=["live"],
+)
+
+
+def _topic(spec: dict) -> Optional[str]:
+    if not isinstance(spec, dict):
+        return None
+    if isinstance(spec.get("ride"), str) and ObjectId.is_valid(spec["ride"]):
+        return ride_topic(spec["ride"])
+    route = spec.get("route")
+    if isinstance(route, dict) and isinstance(route.get("from"), str) and isinstance(route.get("to"), str):
+        return route_topic(route["from"], route["to"])
+    return None
+
+
+async def _snapshot(ride_id: str) -> Optional[bytes]:
+    ride = await mongoDB["rides"].find_one(
+        {"_id": ObjectId(ride_id)}, {"from_location": 1, "to_location": 1, "available_seats": 1, "expired": 1},
+    )
+    if ride is None:
+        return None
+    return dumps({
+        "ride_id": ride_id,
+        "from_location": ride.get("from_location"),
+        "to_location": ride.get("to_location"),
+        "available_seats": ride.get("available_seats"),
+        "expired": ride.get("expired"),
+        "event": "snapshot",
+    })
+
+
+async def _send(websocket: WebSocket, subscriber: Subscriber):
+    while True:
+        message = await subscriber.queue.get()
+        await websocket.send_text(message.decode())
+
+
+async def _receive(websocket: WebSocket, subscriber: Subscriber):
+    while True:
+        try:
+            request = await websocket.receive_json()
+        except ValueError:
+            await websocket.send_json({"error": "expected a JSON message"})
+            continue
+
+        if not isinstance(request, dict):
+            await websocket.send_json({"error": "expected a JSON object"})
+            continue
+
+        if "unsubscribe" in request:
+            topic = _topic(request["unsubscribe"])
+            if topic:
+                seat_feed.unsubscribe(subscriber, topic)
+            continue
+
+        topic = _topic(request.get("subscribe"))
+        if topic is None:
+            await websocket.send_json({"error": "subscribe to {\"ride\": id} or {\"route\": {\"from\": ..., \"to\": ...}}"})
+        elif not seat_feed.subscribe(subscriber, topic):
+            await websocket.send_json({"error": f"at most {LIVE_MAX_SUBSCRIPTIONS} subscriptions per connection"})
+        elif topic.startswith("ride:"):
+            sequence = seat_feed.sequence(topic)
+            snapshot = await _snapshot(request["subscribe"]["ride"])
+            # queued behind any earlier delta; if one arrived while reading, the snapshot may be older than it
+            if snapshot is not None and seat_feed.sequence(topic) == sequence and topic in subscriber.topics:
+                seat_feed.deliver(subscriber, snapshot)
+
+
+@router.websocket("/seats")
+async def live_seats(websocket: WebSocket, token: str = Query(...)):
+    # browsers can't set headers on a WebSocket, so the token comes in the query string
+    try:
+        await get_current_user(token)
+    except HTTPException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    await websocket.accept()
+    subscriber = Subscriber()
+    seat_feed.connections += 1
+
+    tasks = [
+        asyncio.create_task(_send(websocket, subscriber)),
+        asyncio.create_task(_receive(websocket, subscriber)),
+        asyncio.create_task(subscriber.evicted.wait()),
+    ]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        if subscriber.evicted.is_set():
+            await websocket.close(code=SLOW_CONSUMER_CLOSE_CODE, reason="slow consumer")
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        seat_feed.remove(subscriber)
+        seat_feed.connections -= 1
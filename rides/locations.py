@@ -0,0 +1,219 @@
+"""
+    location autocomplete served from memory.
+
+    every location is normalized (diacritics stripped, lower case, punctuation
+    folded to spaces) and known aliases map to one canonical name, which is
+    what create_ride stores and search matches on. suggestions come from a
+    sorted array of normalized keys searched with bisect, ranked by how many
+    rides use each location. the index is loaded from the rides collection
+    at startup, updated as rides are created and reloaded periodically so
+    rides created by other workers show up too.
+"""
+import asyncio
+import os
+import re
+import unicodedata
+from bisect import bisect_left, insort
+from collections import Counter
+from typing import Dict, List
+
+from database import db as mongoDB, read_db
+from metrics import register_stats
+
+
+LOCATION_INDEX_REFRESH = float(os.environ.get("LOCATION_INDEX_REFRESH", 600))
+
+# canonical name: aliases and common spellings
+GAZETTEER = {
+    "abuja": ("fct", "federal capital territory", "abj"),
+    "lagos": ("eko", "lasgidi", "lag"),
+    "kano": (),
+    "ibadan": ("ib",),
+    "port harcourt": ("ph", "portharcourt", "port-harcourt", "phc"),
+    "benin": ("benin city",),
+    "kaduna": (),
+    "zaria": (),
+    "jos": (),
+    "enugu": (),
+    "onitsha": (),
+    "aba": (),
+    "owerri": (),
+    "warri": (),
+    "asaba": (),
+    "calabar": (),
+    "uyo": (),
+    "ilorin": (),
+    "abeokuta": ("abk",),
+    "ijebu ode": ("ijebu-ode",),
+    "sagamu": ("shagamu",),
+    "ogbomosho": ("ogbomoso",),
+    "oyo": (),
+    "osogbo": ("oshogbo",),
+    "ile ife": ("ife", "ile-ife"),
+    "ilesa": ("ilesha",),
+    "akure": (),
+    "ondo": (),
+    "ado ekiti": ("ado-ekiti", "ado"),
+    "lokoja": (),
+    "makurdi": (),
+    "minna": (),
+    "bida": (),
+    "suleja": (),
+    "keffi": (),
+    "lafia": (),
+    "bauchi": (),
+    "gombe": (),
+    "yola": (),
+    "jalingo": (),
+    "maiduguri": ("maid",),
+    "damaturu": (),
+    "potiskum": (),
+    "katsina": (),
+    "funtua": (),
+    "dutse": (),
+    "kafanchan": (),
+    "sokoto": (),
+    "birnin kebbi": ("b kebbi", "birnin-kebbi"),
+    "gusau": (),
+    "abakaliki": (),
+    "awka": (),
+    "nnewi": (),
+    "umuahia": (),
+    "yenagoa": (),
+    "ikom": (),
+    "eket": (),
+    "sapele": (),
+    "auchi": (),
+    "okene": (),
+}
+
+
+def normalize(text: str) -> str:
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    text = re.sub(r"[^a-z0-9]+", " ", text.lower())
+    return text.strip()
+
+
+ALIASES = {normalize(alias): name for name, aliases in GAZETTEER.items() for alias in (name, *aliases)}
+
+
+def canonical_location(text: str) -> str:
+    # "Port-Harcourt", "PH" and "port  harcourt" are all stored and searched as "port harcourt"
+    location = normalize(text)
+    return ALIASES.get(location, location)
+
+
+class LocationIndex:
+
+    def __init__(self, counts: Dict[str, int] = None):
+        self._keys: List[str] = []
+        self._targets: Dict[str, set] = {}
+        self._counts = Counter()
+        # answers for one and two letter prefixes, the widest scans, until the next add
+        self._short = {}
+
+        for name, aliases in GAZETTEER.items():
+            self._add_name(name, aliases)
+        for name, rides in (counts or {}).items():
+            self.add(name, rides)
+
+    def _add_key(self, key: str, name: str):
+        if key not in self._targets:
+            insort(self._keys, key)
+            self._targets[key] = set()
+        self._targets[key].add(name)
+
+    def _add_name(self, name: str, aliases=()):
+        key = normalize(name)
+        self._add_key(key, name)
+        # later words too, so "harcourt" finds port harcourt
+        for word in key.split()[1:]:
+            self._add_key(word, name)
+        for alias in aliases:
+            self._add_key(normalize(alias), name)
+
+    def add(self, location: str, rides: int = 1):
+        name = canonical_location(location)
+        if not name:
+            return
+        if name not in self._targets.get(name, ()):
+            self._add_name(name)
+        self._counts[name] += rides
+        self._short.clear()
+
+    def suggest(self, prefix: str, limit: int = 10) -> list:
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        if (prefix, limit) in self._short:
+            return self._short[prefix, limit]
+
+        names = set()
+        i = bisect_left(self._keys, prefix)
+        while i < len(self._keys) and self._keys[i].startswith(prefix):
+            names.update(self._targets[self._keys[i]])
+            i += 1
+
+        # most used first, then names that start with what was typed, then alphabetical
+        ranked = sorted(names, key=lambda name: (-self._counts[name], not name.startswith(prefix), name))
+        suggestions = [{"name": name, "rides": self._counts[name]} for name in ranked[:limit]]
+        if len(prefix) <= 2:
+            self._short[prefix, limit] = suggestions
+        return suggestions
+
+    def replace(self, other: "LocationIndex"):
+        self._keys, self._targets, self._counts, self._short = other._keys, other._targets, other._counts, other._short
+
+    async def load(self):
+        counts = Counter()
+        for field in ("from_location", "to_location"):
+            async for row in read_db("rides")["rides"].aggregate([{"$group": {"_id": f"${field}", "rides": {"$sum": 1}}}]):
+                if isinstance(row["_id"], str):
+                    counts[row["_id"]] += row["rides"]
+        self.replace(LocationIndex(counts))
+
+    def stats(self) -> dict:
+        return {"keys": len(self._keys), "locations": len(self._counts)}
+
+
+class LocationIndexRefresher:
+
+    def __init__(self, index: LocationIndex, interval: float = LOCATION_INDEX_REFRESH):
+        self.index = index
+        self.interval = interval
+        self._task = None
+
+    def start(self, after: asyncio.Task = None):
+        self._task = asyncio.create_task(self.run(after))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def run(self, after: asyncio.Task = None):
+        # wait for migrations, so stored locations are already canonical
+        if after is not None:
+            await asyncio.wait([after])
+        while True:
+            try:
+                await self.index.load()
+            except Exception as err:
+                print(err, )
+            await asyncio.sleep(self.interval)
+
+
+async def canonicalize_locations():
+    # rides stored before locations were canonicalized would never match a search
+    for field in ("from_location", "to_location"):
+        for location in await mongoDB["rides"].distinct(field):
+            if isinstance(location, str) and canonical_location(location) != location:
+                await mongoDB["rides"].update_many({field: location}, {"$set": {field: canonical_location(location)}})
+
+
+location_index = LocationIndex()
+location_index_refresher = LocationIndexRefresher(location_index)
+
+register_stats("location_index", "Locations and search keys in the autocomplete index.", location_index.stats)
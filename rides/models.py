@@ -1,14 +1,20 @@
-from typing import Annotated, Union
+from typing import Annotated, Union, Literal, Tuple
 from pydantic import BaseModel, Field, EmailStr
 from bson import ObjectId
 from typing import Optional, List
 from datetime import datetime
 
+class GeoPoint(BaseModel):
+    # GeoJSON point, coordinates are [longitude, latitude]
+    type: Literal["Point"] = "Point"
+    coordinates: Tuple[Annotated[float, Field(ge=-180, le=180)], Annotated[float, Field(ge=-90, le=90)]]
+
+
 class Passenger(BaseModel):
     id: str = Field(None)
     user_id: str = Field(None)
     ride_id: str = Field(None)
-    no_seats: int = Field(...)
+    no_seats: int = Field(..., gt=0)
     price: float = Field(None)
 
     class Config:
@@ -35,6 +41,9 @@ class Ride(BaseModel):
     driver_id: str = Field(None)
     expired: bool = False   
     available_seats: int = Field(None)
+    departure: datetime = Field(None)
+    pickup_point: Optional[GeoPoint] = Field(None)
+    dropoff_point: Optional[GeoPoint] = Field(None)
 
     passengers: List[Passenger] = Field(default=[])
 
@@ -54,6 +63,8 @@ class Ride(BaseModel):
                 "seats": 4,
                 "car_id": "6505ff80e9af984125dc51ac",
                 "seat_price": 4000.00,
+                "pickup_point": {"type": "Point", "coordinates": [8.5167, 11.9964]},
+                "dropoff_point": {"type": "Point", "coordinates": [7.4951, 9.0579]},
             }
         }
 
@@ -73,6 +84,9 @@ class Ride(BaseModel):
                 "car_id": self.car_id,
                 "expired": self.expired,  
                 "available_seats": self.available_seats,
+                "departure": self.departure,
+                "pickup_point": self.pickup_point,
+                "dropoff_point": self.dropoff_point,
 
                 "passengers": self.passengers
         }
\ No newline at end of file
@@ -1,14 +1,25 @@
-from fastapi import FastAPI, APIRouter, Depends, HTTPException, status, Query, BackgroundTasks
-from fastapi.encoders import jsonable_encoder
-from fastapi.responses import Response, JSONResponse
+from fastapi import FastAPI, APIRouter, Depends, HTTPException, status, Query, Request
+from fastapi.responses import Response
 from datetime import datetime, timedelta
-from typing import Annotated, List
+from typing import Annotated
 from bson import ObjectId
 
 from .models import Ride, Passenger
-from database import db as mongoDB
+from .utils import (
+                        parse_departure,
+                        encode_ride,
+                        enrich_rides,
+                        load_search,
+                        geo_search,
+                )
+from .cache import search_cache, ride_lookups, SEARCH_CACHE_MAX_RIDES
+from .locations import canonical_location, location_index
+from database import db as mongoDB, read_db
+from metrics import ride_bookings
+from responses import ORJSONResponse
+from pagination import PageParams, paginate, page_cursor, page_response, decode_cursor, encode_cursor
+from streaming import wants_stream, stream_response
 from auth.models import UserModel
-from auth.utils import filter_none_and_empty_fields, castObjectId
 from driver.models import DriverModel
 from driver.dependencies import get_current_user_by_jwtoken, get_token_header
 
@@ -19,6 +30,9 @@ router = APIRouter(
     responses={404: {"description": "Not found"}},
 )
 
+# search and listing scans may be served by a secondary, booking stays on the primary
+readDB = read_db("rides")
+
 # Define the sorting field and order (ascending: 1, descending: -1)
 sort_field = "date"
 sort_order = 1  # Ascending order
@@ -30,57 +44,74 @@ async def create_ride(ride: Ride, user: Annotated[UserModel, Depends(get_current
     if user.is_active:
         ride.driver_id = user.id
         ride.available_seats = ride.seats
-        ride.from_location = ride.from_location.lower()
-        ride.to_location = ride.to_location.lower()
+        ride.from_location = canonical_location(ride.from_location)
+        ride.to_location = canonical_location(ride.to_location)
 
         ride.dropoff_location = ride.dropoff_location.lower()
         ride.pickup_location = ride.pickup_location.lower()
 
-        ride_data = jsonable_encoder(ride)
+        ride.departure = parse_departure(ride.date, ride.time)
+        if ride.departure is None:
+            return ORJSONResponse(status_code=status.HTTP_400_BAD_REQUEST, content={"error": "invalid ride date or time"})
+
+        ride_data = ride.model_dump()
 
         # Insert the ride data into the MongoDB collection
         result = await mongoDB["rides"].insert_one(ride_data)
+        search_cache.invalidate(ride.from_location, ride.to_location)
+        location_index.add(ride.from_location)
+        location_index.add(ride.to_location)
 
         ride.id = str(result.inserted_id)
 
-        return JSONResponse(status_code=status.HTTP_201_CREATED, content=ride.encode())
-    return JSONResponse(status_code=status.HTTP_400_BAD_REQUEST, content={"error": "encountered error creating ride, driver not verified"})
+        return ORJSONResponse(status_code=status.HTTP_201_CREATED, content=ride.encode())
+    return ORJSONResponse(status_code=status.HTTP_400_BAD_REQUEST, content={"error": "encountered error creating ride, driver not verified"})
 
 
 @router.put("/{rideId}/book/ride", response_description="book a ride", response_model=Ride)
 async def book_ride(rideId: str, passenger: Passenger, current_user: Annotated[UserModel, Depends(get_current_user_by_jwtoken)]):
-    ride = await mongoDB["rides"].find_one({"_id": ObjectId(rideId)})
+    ride = await mongoDB["rides"].find_one({"_id": ObjectId(rideId)}, {"seat_price": 1, "expired": 1, "from_location": 1, "to_location": 1})
 
     if ride:
-        ride["id"] = str(ride["_id"])
-        ride = Ride(**ride)
-
-        if not(ride.expired) and current_user.is_active:
+        if not(ride["expired"]) and current_user.is_active:
 
+            passenger.id = str(ObjectId())
             passenger.ride_id = rideId
             passenger.user_id = current_user.id
-            passenger.price = float(ride.seat_price * passenger.no_seats)
-
-        
-            passenger_data = jsonable_encoder(passenger)
-
-            # Insert the passenger data into the MongoDB collection
-            result = await mongoDB["passengers"].insert_one(passenger_data)
-            passenger.id = str(result.inserted_id)
-
-            ride.available_seats = ride.available_seats - passenger.no_seats
-            ride.passengers.append(passenger)
-
-            ride_enc = jsonable_encoder(ride)
-            filtered_update_data = filter_none_and_empty_fields(ride_enc)
-            
-            update_result = await mongoDB["rides"].update_one({"_id": ObjectId(rideId)}, {"$set": filtered_update_data})
-            
-            if update_result.modified_count == 1:
-                return JSONResponse(status_code=status.HTTP_200_OK, content={"message":"ride booked successfully"})
-            
-            return JSONResponse(status_code=status.HTTP_200_OK, content={"message": "failed to book ride"})
-        return JSONResponse(status_code=status.HTTP_200_OK, content={"message": "ride has expired or user is not active"})
+            passenger.price = float(ride["seat_price"] * passenger.no_seats)
+
+            passenger_data = passenger.model_dump()
+
+            # reserve the seats in a single conditional update so concurrent
+            # bookings can never oversell the ride
+            update_result = await mongoDB["rides"].update_one(
+                {"_id": ObjectId(rideId), "expired": False, "available_seats": {"$gte": passenger.no_seats}},
+                {"$inc": {"available_seats": -passenger.no_seats}, "$push": {"passengers": passenger_data}},
+            )
+
+            if update_result.modified_count != 1:
+                ride_bookings.inc(outcome="conflict")
+                # whoever searched this route is likely looking at seats that are gone
+                search_cache.invalidate(ride["from_location"], ride["to_location"])
+                return ORJSONResponse(status_code=status.HTTP_409_CONFLICT, content={"error": "not enough seats available or ride has expired"})
+
+            try:
+                await mongoDB["passengers"].insert_one({"_id": ObjectId(passenger.id), **passenger_data})
+            except Exception as err:
+                # give the seats back if the booking record could not be written
+                await mongoDB["rides"].update_one(
+                    {"_id": ObjectId(rideId)},
+                    {"$inc": {"available_seats": passenger.no_seats}, "$pull": {"passengers": {"id": passenger.id}}},
+                )
+                print(err, )
+                ride_bookings.inc(outcome="failed")
+                return ORJSONResponse(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, content={"message": "failed to book ride"})
+
+            search_cache.invalidate(ride["from_location"], ride["to_location"])
+            ride_bookings.inc(outcome="booked")
+            return ORJSONResponse(status_code=status.HTTP_200_OK, content={"message":"ride booked successfully"})
+        ride_bookings.inc(outcome="expired_or_inactive")
+        return ORJSONResponse(status_code=status.HTTP_409_CONFLICT, content={"error": "ride has expired or user is not active"})
     # ride not found
     raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"ride with Id: {rideId} not found")
 
@@ -88,13 +119,12 @@ async def book_ride(rideId: str, passenger: Passenger, current_user: Annotated[U
 @router.get("/{rideId}/ride", response_description="fetch a ride", response_model=Ride)
 async def get_ride_by_id(rideId: str, current_user: Annotated[UserModel, Depends(get_current_user_by_jwtoken)]):
     
-    ride = await mongoDB["rides"].find_one({"_id": ObjectId(rideId)})
+    # concurrent requests for the same ride share one query
+    ride = await ride_lookups.do(rideId, lambda: mongoDB["rides"].find_one({"_id": ObjectId(rideId)}))
     if ride:
 
-        ride["id"] = str(ride["_id"])
-        ride = Ride(**ride)
-        ride_enc = jsonable_encoder(ride)
-        return JSONResponse(status_code=status.HTTP_200_OK, content=ride_enc)
+        ride = {**ride, "id": str(ride["_id"])}
+        return ORJSONResponse(status_code=status.HTTP_200_OK, content=Ride(**ride))
 
     # ride not found
     raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"ride with Id: {rideId} not found")
@@ -102,166 +132,145 @@ async def get_ride_by_id(rideId: str, current_user: Annotated[UserModel, Depends
 
 
 @router.get("/{userId}/ordered/ride", response_description="find all users ordered ride", response_model=Ride)       
-async def get_ordered_ride(userId: str, current_user: Annotated[UserModel, Depends(get_current_user_by_jwtoken)]):
+async def get_ordered_ride(userId: str, current_user: Annotated[UserModel, Depends(get_current_user_by_jwtoken)],
+                        page: Annotated[PageParams, Depends()],
+                        order: Annotated[str, Query(pattern="^(asc|desc)$")] = "asc",
+    ):
 
     if userId == current_user.id:
-        booked_rides = []
-        async for ride in mongoDB["rides"].find():
-            try: 
-                castObjectId(ride)
-                ridemodel = Ride(**ride)
-                del ride["passengers"]
-
-                for passenger in ridemodel.passengers:
-                    
-                    if userId == passenger.user_id:
-                    
-
-                        car_obj = await mongoDB["cars"].find_one({"_id": ObjectId(ridemodel.car_id)})
-                        driver_obj = await mongoDB["users"].find_one({"_id": ObjectId(ridemodel.driver_id)})
-                        
-                        if car_obj:
-                            ride["car_model"] = car_obj["model"]
-                            ride["car_color"] = car_obj["color"]
-                            ride["car_type"] = car_obj["c_type"]
-                        if driver_obj:
-                            ride["driver_name"] = driver_obj["name"]
-                            ride["driver_phone"] = driver_obj["phone"]
-
-                            
-                        booked_rides.append(ride)
-            except Exception as err:
-                raise err
-        return JSONResponse(status_code=status.HTTP_200_OK, content=booked_rides)
-    return JSONResponse(status_code=status.HTTP_400_BAD_REQUEST, content={"error": "credential errors, different uid and cuid"})
+        direction = -1 if order == "desc" else 1
 
+        # the passengers collection already records every booking, so this
+        # scales with the user's own bookings rather than the whole platform
+        ride_ids = await mongoDB["passengers"].distinct("ride_id", {"user_id": userId})
+        query = {"_id": {"$in": [ObjectId(ride_id) for ride_id in ride_ids if ObjectId.is_valid(ride_id)]}}
 
-async def SetExpiredRides(ride_ids: List[ObjectId]):
-    
-    update_data = {"expired": True}
-    
-    res = await mongoDB['rides'].update_many(
-        {'_id': {'$in': ride_ids}},
-        {'$set': update_data}
-    )
-    
-    print(res.modified_count)
+        booked_rides, next_cursor = await paginate(
+            mongoDB["rides"], query, {"passengers": 0},
+            sort_key="departure", direction=direction, cursor=page.cursor, limit=page.limit,
+        )
+        booked_rides = [encode_ride(ride) for ride in booked_rides]
+        await enrich_rides(booked_rides)
+
+        return page_response(booked_rides, next_cursor)
+    return ORJSONResponse(status_code=status.HTTP_400_BAD_REQUEST, content={"error": "credential errors, different uid and cuid"})
 
 
 @router.get("/published/rides", response_description="find all rides published by a driver", response_model=Ride)
-async def get_published_rides(current_user: Annotated[UserModel, Depends(get_current_user_by_jwtoken)], background_tasks: BackgroundTasks):
-    
-    rides = []
-    expired_rides_ls = []
-    
-    async for ride in mongoDB["rides"].find({"driver_id": current_user.id}):
-        if not ride["expired"]:
-            ride["id"] = str(ride["_id"])
-            del ride["_id"]
-
-            rides.append(ride)
-        else:
-            expired_rides_ls.append(ride["_id"])
-            
-    try:
-        background_tasks.add_task(SetExpiredRides, expired_rides_ls)
-    except Exception as err:
-        print(err, )
-    
-    return JSONResponse(status_code=status.HTTP_200_OK, content=rides)
+async def get_published_rides(current_user: Annotated[UserModel, Depends(get_current_user_by_jwtoken)], page: Annotated[PageParams, Depends()]):
+
+    rides, next_cursor = await paginate(
+        readDB["rides"], {"driver_id": current_user.id, "expired": False},
+        sort_key="departure", cursor=page.cursor, limit=page.limit,
+    )
+
+    return page_response([encode_ride(ride) for ride in rides], next_cursor)
 
 
 
 
 @router.get("/q/search/ride", response_description="search for a ride", response_model=Ride)
 async def search_rides(current_user: Annotated[UserModel, Depends(get_current_user_by_jwtoken)], 
-                        background_tasks: BackgroundTasks, start_loc: Annotated[str, Query(max_length=50)] = None,
+                        page: Annotated[PageParams, Depends()],
+                        start_loc: Annotated[str, Query(max_length=50)] = None,
                         to_loc: Annotated[str, Query(max_length=50)] = None,
-                        seats: int = None
+                        seats: int = 1,
+                        near_lng: Annotated[float, Query(ge=-180, le=180)] = None,
+                        near_lat: Annotated[float, Query(ge=-90, le=90)] = None,
+                        radius_km: Annotated[float, Query(gt=0, le=100)] = 5,
     ):
 
-    search_results = []
-    expired_rides_ls = []
+    now = datetime.now()
+    key = search_cache.key(canonical_location(start_loc), canonical_location(to_loc), seats)
+    from_location, to_location = key[0], key[1]
+
+    if near_lng is not None and near_lat is not None:
+        # rides leaving near the rider, nearest first; only rides created with a pickup_point match
+        query = {
+            "to_location": to_location,
+            "departure": {"$gt": now},
+            "available_seats": {"$gte": seats},
+            "expired": False,
+            "driver_id": {"$ne": current_user.id},
+            "passengers.user_id": {"$ne": current_user.id},
+        }
+        if from_location:
+            query["from_location"] = from_location
+
+        search_results, next_cursor = await geo_search(
+            readDB, query, near_lng, near_lat, radius_km * 1000, cursor=page.cursor, limit=page.limit,
+        )
+        search_results = [encode_ride(ride) for ride in search_results]
+        await enrich_rides(search_results, readDB)
+        return page_response(search_results, next_cursor)
+
+    # the cached rides are the same for everyone, the caller's own rides and
+    # bookings are filtered out afterwards
+    candidates, complete = await search_cache.get_or_load(
+        key, lambda: load_search(readDB, from_location, to_location, seats, now, SEARCH_CACHE_MAX_RIDES),
+    )
 
-    # Create indexes on start_location and to_location
-    await mongoDB["rides"].create_index([("from_location", 1)])  # 1 for ascending order
-    await mongoDB["rides"].create_index([("to_location", 1)])
+    after = decode_cursor(page.cursor, datetime) if page.cursor else None
+    search_results = []
+    for ride, riders, ride_id in candidates:
+        if ride["departure"] <= now or (after and (ride["departure"], ride_id) <= after):
+            continue
+        if ride["driver_id"] == current_user.id or current_user.id in riders:
+            continue
+        search_results.append(ride)
+        if len(search_results) == page.limit:
+            return page_response(search_results, encode_cursor(ride["departure"], ride_id))
+
+    if complete:
+        return page_response(search_results, None)
+
+    # paged past what the cache holds
+    query = {
+        "from_location": from_location,
+        "to_location": to_location,
+        "departure": {"$gt": now},
+        "available_seats": {"$gte": seats},
+        "expired": False,
+        "driver_id": {"$ne": current_user.id},
+        "passengers.user_id": {"$ne": current_user.id},
+    }
+
+    search_results, next_cursor = await paginate(
+        readDB["rides"], query, {"passengers": 0},
+        sort_key="departure", cursor=page.cursor, limit=page.limit,
+    )
+    search_results = [encode_ride(ride) for ride in search_results]
+    await enrich_rides(search_results, readDB)
 
+    return page_response(search_results, next_cursor)
 
-    # Perform the search query
-    async for ride in mongoDB["rides"].find({"from_location": start_loc.lower(), "to_location": to_loc.lower()}):
-        castObjectId(ride)
 
-        date_format = "%Y-%d-%m %H:%M" #:%S "%Y-%m-%d %H:%M:%S.%f"
-        ride_datetime_str = f"{ride['date']} {ride['time']}"
 
-        try:
-            # parse the string into a datetime object
-            dt_obj = datetime.strptime(ride_datetime_str, date_format)
-        except ValueError as e:
-            print(f"datetime parsing error: {e}")
-            continue
 
-        if not ride["expired"]:            
-            # Format the current date and time in the desired format (year-day-month hour:minute)
-            formatted_datetime = datetime.strptime(datetime.now().strftime(date_format), date_format)
-
-            
-            
-            if dt_obj.__gt__(formatted_datetime):
-                if ride["available_seats"] >= seats and not(ride["driver_id"] == current_user.id):
-                    car_obj = await mongoDB["cars"].find_one({"_id": ObjectId(ride["car_id"])})
-                    if car_obj:
-                        ride["car_model"] = car_obj["model"]
-                        ride["car_color"] = car_obj["color"]
-                        ride["car_type"] = car_obj["c_type"]
-                    
-                    driver_obj = await mongoDB["users"].find_one({"_id": ObjectId(ride["driver_id"])})
-                    if driver_obj:
-                        ride["driver_name"] = driver_obj["name"]
-                        ride["driver_phone"] = driver_obj["phone"]
-
-                    if await NoPassengerIsCurrentUser(ride["passengers"], current_user.id):
-                        del ride["passengers"]
-                        search_results.append(ride)
-
-            else:
-                print(ride["id"])
-                expired_rides_ls.append(ObjectId(ride["id"]))
- 
-    try:
-        background_tasks.add_task(SetExpiredRides, expired_rides_ls)
-    except Exception as err:
-        print(err, )
-        
-    return JSONResponse(status_code=status.HTTP_200_OK, content=search_results)
-
-
-
-
-async def NoPassengerIsCurrentUser(passengers: List, cuid: str):
-    for passenger in passengers:
-        if str(cuid) == str(passenger["user_id"]):
-            return False
-    return True
+@router.get("/locations/autocomplete", response_description="suggest ride locations for a prefix")
+async def autocomplete_locations(q: Annotated[str, Query(min_length=1, max_length=50)],
+                                 limit: Annotated[int, Query(gt=0, le=20)] = 10):
+    # served from memory, the names returned are exactly what search expects
+    return ORJSONResponse(status_code=status.HTTP_200_OK, content=location_index.suggest(q, limit))
 
 
 @router.get("/all", response_description="fetch all rides", response_model=Ride)
-async def all_rides(current_user: Annotated[UserModel, Depends(get_current_user_by_jwtoken)]):
-    rides = []
-    async for ride in mongoDB["rides"].find():
-        ride["id"] = str(ride["_id"])
-        del ride["_id"]
+async def all_rides(request: Request, current_user: Annotated[UserModel, Depends(get_current_user_by_jwtoken)],
+                    page: Annotated[PageParams, Depends()], stream: bool = False):
+    if wants_stream(request, stream):
+        rides_cursor = page_cursor(readDB["rides"], {}, {"passengers": 0}, cursor=page.cursor, limit=0)
+        return stream_response(request, rides_cursor, encode_ride)
 
-        rides.append(ride)
-    return JSONResponse(status_code=status.HTTP_200_OK, content=rides)
+    rides, next_cursor = await paginate(readDB["rides"], {}, {"passengers": 0}, cursor=page.cursor, limit=page.limit)
+    return page_response([encode_ride(ride) for ride in rides], next_cursor)
 
 
 @router.delete("/delete/{rideId}", response_description="delete a particular ride", response_model=Ride)
 async def delete_ride(rideId: str, current_user: Annotated[UserModel, Depends(get_current_user_by_jwtoken)]):
-    deleted = await mongoDB["rides"].delete_one({"_id": ObjectId(rideId)})
+    deleted = await mongoDB["rides"].find_one_and_delete({"_id": ObjectId(rideId)}, {"from_location": 1, "to_location": 1})
     if deleted:
-        return JSONResponse(content={"msg": "ride deleted successfully"}, status_code=status.HTTP_200_OK)
-    return JSONResponse(content={"error": ""})
+        search_cache.invalidate(deleted["from_location"], deleted["to_location"])
+        return ORJSONResponse(content={"msg": "ride deleted successfully"}, status_code=status.HTTP_200_OK)
+    return ORJSONResponse(content={"error": ""})
 
 
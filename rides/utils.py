@@ -0,0 +1,133 @@
+import asyncio
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from bson import ObjectId
+
+from database import db as mongoDB
+from driver.utils import rating_summary
+from pagination import DEFAULT_PAGE_SIZE, decode_cursor, encode_cursor
+
+
+# rides are created with the date and time as sent by the client, the search
+# path has always read them back in this format
+DEPARTURE_FORMAT = "%Y-%d-%m %H:%M"
+
+
+def parse_departure(date, time) -> Optional[datetime]:
+    try:
+        return datetime.strptime(f"{date} {time}", DEPARTURE_FORMAT)
+    except (TypeError, ValueError):
+        return None
+
+
+def encode_ride(ride: dict) -> dict:
+    # expose the ride's _id as id, like every other ride response
+    ride["id"] = str(ride["_id"])
+    del ride["_id"]
+    return ride
+
+
+async def _find_by_ids(db, collection: str, ids: set, projection: dict) -> dict:
+    object_ids = [ObjectId(_id) for _id in ids if ObjectId.is_valid(_id)]
+    if not object_ids:
+        return {}
+    return {
+        str(doc["_id"]): doc
+        async for doc in db[collection].find({"_id": {"$in": object_ids}}, projection)
+    }
+
+
+async def enrich_rides(rides: List[dict], db=mongoDB) -> List[dict]:
+    # attach car and driver details to a page of rides with one query per
+    # collection instead of two lookups per ride
+    cars, drivers = await asyncio.gather(
+        _find_by_ids(db, "cars", {ride.get("car_id") for ride in rides}, {"model": 1, "color": 1, "c_type": 1}),
+        # rating totals are copied onto the driver's user, so they come with the name
+        _find_by_ids(db, "users", {ride.get("driver_id") for ride in rides}, {"name": 1, "phone": 1, "driver_rating": 1}),
+    )
+
+    for ride in rides:
+        car_obj = cars.get(ride.get("car_id"))
+        if car_obj:
+            ride["car_model"] = car_obj["model"]
+            ride["car_color"] = car_obj["color"]
+            ride["car_type"] = car_obj["c_type"]
+
+        driver_obj = drivers.get(ride.get("driver_id"))
+        if driver_obj:
+            ride["driver_name"] = driver_obj["name"]
+            ride["driver_phone"] = driver_obj["phone"]
+
+        rating = rating_summary((driver_obj or {}).get("driver_rating"))
+        ride["driver_rating"] = rating["mean"]
+        ride["driver_rating_count"] = rating["count"]
+    return rides
+
+
+# everything search returns, plus who rode along so callers can be filtered out later
+SEARCH_PROJECTION = {"passengers.id": 0, "passengers.ride_id": 0, "passengers.no_seats": 0, "passengers.price": 0}
+
+
+async def load_search(db, from_location: str, to_location: str, seats: int, now: datetime, limit: int) -> Tuple[list, bool]:
+    """
+        the first `limit` upcoming rides on a route with `seats` free, enriched
+        and paired with their riders and _id. the result doesn't depend on who
+        is searching, so it can be shared through the search cache. the flag
+        is False when more rides exist than were loaded.
+    """
+    query = {
+        "from_location": from_location,
+        "to_location": to_location,
+        "departure": {"$gt": now},
+        "available_seats": {"$gte": seats},
+        "expired": False,
+    }
+    rides = await db["rides"].find(query, SEARCH_PROJECTION).sort([("departure", 1), ("_id", 1)]).to_list(length=limit + 1)
+    complete = len(rides) <= limit
+    rides = rides[:limit]
+
+    ride_ids = [ride["_id"] for ride in rides]
+    riders = [frozenset(passenger.get("user_id") for passenger in ride.pop("passengers", [])) for ride in rides]
+    rides = [encode_ride(ride) for ride in rides]
+    await enrich_rides(rides, db)
+    return list(zip(rides, riders, ride_ids)), complete
+
+
+async def geo_search(db, query: dict, longitude: float, latitude: float, radius_m: float,
+                     cursor: str = None, limit: int = DEFAULT_PAGE_SIZE) -> Tuple[list, Optional[str]]:
+    """
+        rides matching `query` whose pickup point is within `radius_m` of the
+        rider, nearest first, each with its distance_m. paged by (distance, _id)
+        so a page starts at the previous page's distance instead of skipping.
+    """
+    geo_near = {
+        "near": {"type": "Point", "coordinates": [longitude, latitude]},
+        "key": "pickup_point",
+        "distanceField": "distance_m",
+        "maxDistance": radius_m,
+        "query": query,
+        "spherical": True,
+    }
+    pipeline = [{"$geoNear": geo_near}]
+    if cursor:
+        distance, ride_id = decode_cursor(cursor, (int, float))
+        geo_near["minDistance"] = distance
+        pipeline.append({"$match": {"$or": [{"distance_m": {"$gt": distance}}, {"distance_m": distance, "_id": {"$gt": ride_id}}]}})
+    pipeline += [
+        {"$sort": {"distance_m": 1, "_id": 1}},
+        {"$limit": limit},
+        {"$project": {"passengers": 0}},
+    ]
+
+    rides = await db["rides"].aggregate(pipeline).to_list(length=limit)
+    next_cursor = encode_cursor(rides[-1]["distance_m"], rides[-1]["_id"]) if len(rides) == limit else None
+    return rides, next_cursor
+
+
+async def backfill_departures():
+    # rides created before departure was stored can't be matched by search
+    async for ride in mongoDB["rides"].find({"departure": {"$exists": False}}, {"date": 1, "time": 1}):
+        departure = parse_departure(ride.get("date"), ride.get("time"))
+        if departure:
+            await mongoDB["rides"].update_one({"_id": ride["_id"]}, {"$set": {"departure": departure}})
@@ -0,0 +1,224 @@
+"""
+    indexes and data migrations the routers rely on.
+
+    the app builds these in the background from its lifespan. the same checks
+    can be run by hand:
+
+        python -m schema build      # create missing indexes, run migrations, set collection options
+        python -m schema check      # report drift between declared and live indexes
+        python -m schema explain    # show which index serves each hot query
+        python -m schema duplicates # transactions blocking the unique transaction indexes
+"""
+import asyncio
+import sys
+from datetime import datetime
+
+from pymongo import ASCENDING, DESCENDING, GEOSPHERE, IndexModel
+from pymongo.errors import OperationFailure
+
+from auth.mailer import MAIL_RETENTION_DAYS
+from database import db as mongoDB
+from rides.utils import backfill_departures
+from rides.locations import canonicalize_locations
+from driver.utils import backfill_user_ratings, move_embedded_ratings
+
+
+INDEXES = {
+    # auth: login, signup and token lookups by email
+    "users": [
+        IndexModel([("email", ASCENDING)], name="user_email"),
+    ],
+    # cars: a driver's cars
+    "cars": [
+        IndexModel([("user_id", ASCENDING), ("_id", ASCENDING)], name="car_owner"),
+    ],
+    "rides": [
+        # /q/search/ride: equality on the route, then the (departure, _id) sort keys, then the seats range
+        IndexModel([("from_location", ASCENDING), ("to_location", ASCENDING), ("departure", ASCENDING), ("_id", ASCENDING), ("available_seats", ASCENDING)], name="ride_search"),
+        # /published/rides
+        IndexModel([("driver_id", ASCENDING), ("departure", ASCENDING), ("_id", ASCENDING)], name="ride_driver"),
+        # expiry sweeper
+        IndexModel([("expired", ASCENDING), ("departure", ASCENDING)], name="ride_expiry"),
+        # /q/search/ride near a pickup point, rides without a pickup_point aren't indexed
+        IndexModel([("pickup_point", GEOSPHERE), ("to_location", ASCENDING), ("departure", ASCENDING)], name="ride_pickup_geo"),
+    ],
+    # one rating per rider and driver, the upsert relies on it
+    "driver_ratings": [
+        IndexModel([("driver_id", ASCENDING), ("rater", ASCENDING)], name="rating_driver_rater", unique=True),
+    ],
+    # /{driver_id}/reviews, newest first
+    "driver_reviews": [
+        IndexModel([("driver_id", ASCENDING), ("_id", DESCENDING)], name="review_driver"),
+    ],
+    "passengers": [
+        # /{userId}/ordered/ride
+        IndexModel([("user_id", ASCENDING)], name="passenger_bookings"),
+        IndexModel([("ride_id", ASCENDING)], name="passenger_ride"),
+    ],
+    "transactions": [
+        IndexModel([("userid", ASCENDING), ("_id", ASCENDING)], name="transaction_user"),
+        # payment callbacks are retried, these make a retry a duplicate instead of a second record
+        IndexModel([("transactionid", ASCENDING)], name="transaction_id", unique=True),
+        IndexModel([("trxn_referenceid", ASCENDING)], name="transaction_reference", unique=True),
+    ],
+    # background mail dispatcher claims due messages
+    "mail_outbox": [
+        IndexModel([("status", ASCENDING), ("next_attempt_at", ASCENDING)], name="outbox_due"),
+        # finished messages expire, pending ones have neither field
+        IndexModel([("sent_at", ASCENDING)], name="outbox_sent_ttl", expireAfterSeconds=int(MAIL_RETENTION_DAYS * 86400)),
+        IndexModel([("failed_at", ASCENDING)], name="outbox_failed_ttl", expireAfterSeconds=int(MAIL_RETENTION_DAYS * 86400)),
+    ],
+}
+
+
+# collMod options, set by `python -m schema build` only rather than by every worker
+COLLECTION_OPTIONS = {
+    # pre-images let the live seat feed route deletes, MongoDB 6.0+
+    "rides": {"changeStreamPreAndPostImages": {"enabled": True}},
+}
+
+
+MIGRATIONS = [
+    backfill_departures,
+    canonicalize_locations,
+    move_embedded_ratings,
+    backfill_user_ratings,
+]
+
+
+# (name, collection, filter, sort) for every query on a hot path
+HOT_QUERIES = [
+    ("search rides", "rides", {
+        "from_location": "kano", "to_location": "abuja", "departure": {"$gt": datetime.now()},
+        "available_seats": {"$gte": 1}, "expired": False,
+    }, [("departure", ASCENDING), ("_id", ASCENDING)]),
+    ("search rides near pickup", "rides", {
+        "pickup_point": {"$near": {"$geometry": {"type": "Point", "coordinates": [8.5167, 11.9964]}, "$maxDistance": 5000}},
+        "to_location": "abuja", "departure": {"$gt": datetime.now()}, "available_seats": {"$gte": 1}, "expired": False,
+    }, None),
+    ("expired rides", "rides", {"expired": False, "departure": {"$lte": datetime.now()}}, None),
+    ("published rides", "rides", {"driver_id": "000000000000000000000000", "expired": False}, [("departure", ASCENDING), ("_id", ASCENDING)]),
+    ("user bookings", "passengers", {"user_id": "000000000000000000000000"}, None),
+    ("user by email", "users", {"email": "user@example.com"}, None),
+    ("driver reviews", "driver_reviews", {"driver_id": "000000000000000000000000"}, [("_id", DESCENDING)]),
+    ("user cars", "cars", {"user_id": "000000000000000000000000"}, [("_id", ASCENDING)]),
+    ("user transactions", "transactions", {"userid": "000000000000000000000000"}, [("_id", ASCENDING)]),
+    ("due mail", "mail_outbox", {"status": "pending", "next_attempt_at": {"$lte": datetime.utcnow()}}, [("next_attempt_at", ASCENDING)]),
+]
+
+
+async def ensure_indexes():
+    for collection, indexes in INDEXES.items():
+        try:
+            live = await mongoDB[collection].index_information()
+        except OperationFailure as err:
+            print(f"index build failed on {collection}: {err}")
+            continue
+
+        # one at a time, so an index that can't be built (a unique index over
+        # duplicates) doesn't take the others in the collection down with it
+        for index in indexes:
+            name = index.document["name"]
+            try:
+                # an index whose declared keys changed is rebuilt, create_indexes would refuse the name
+                if name in live and list(live[name]["key"]) != list(index.document["key"].items()):
+                    await mongoDB[collection].drop_index(name)
+                await mongoDB[collection].create_indexes([index])
+            except OperationFailure as err:
+                print(f"index {name} failed on {collection}: {err}")
+
+
+async def duplicate_transactions() -> list:
+    # what keeps the unique transaction indexes from building, to reconcile by hand
+    report = []
+    for key in ("transactionid", "trxn_referenceid"):
+        async for row in mongoDB["transactions"].aggregate([
+            {"$group": {"_id": f"${key}", "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+            {"$match": {"count": {"$gt": 1}}},
+        ], allowDiskUse=True):
+            report.append((key, row["_id"], [str(_id) for _id in row["ids"]]))
+    return report
+
+
+async def apply_collection_options():
+    for collection, options in COLLECTION_OPTIONS.items():
+        try:
+            await mongoDB.command({"collMod": collection, **options})
+        except OperationFailure as err:
+            # an older server without the option
+            print(f"collMod failed on {collection}: {err}")
+
+
+async def run_migrations():
+    for migration in MIGRATIONS:
+        await migration()
+
+
+async def check_drift() -> dict:
+    drift = {}
+    for collection, indexes in INDEXES.items():
+        live = await mongoDB[collection].index_information()
+        declared = {index.document["name"]: list(index.document["key"].items()) for index in indexes}
+
+        missing = [name for name in declared if name not in live]
+        changed = [name for name in declared if name in live and list(live[name]["key"]) != declared[name]]
+        undeclared = [name for name in live if name != "_id_" and name not in declared]
+
+        if missing or changed or undeclared:
+            drift[collection] = {"missing": missing, "changed": changed, "undeclared": undeclared}
+    return drift
+
+
+async def ensure_schema():
+    await ensure_indexes()
+    await run_migrations()
+
+    drift = await check_drift()
+    for collection, report in drift.items():
+        print(f"index drift on {collection}: {report}")
+
+
+def _index_names(plan: dict) -> list:
+    names = []
+    if plan.get("stage") == "IXSCAN":
+        names.append(plan["indexName"])
+    for child in [plan.get("inputStage")] + plan.get("inputStages", []):
+        if child:
+            names.extend(_index_names(child))
+    return names
+
+
+async def explain_hot_queries() -> list:
+    report = []
+    for name, collection, query, sort in HOT_QUERIES:
+        cursor = mongoDB[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        plan = (await cursor.explain())["queryPlanner"]["winningPlan"]
+        report.append((name, collection, _index_names(plan) or ["COLLSCAN"]))
+    return report
+
+
+async def _main(command: str):
+    if command == "build":
+        await ensure_schema()
+        await apply_collection_options()
+    elif command == "check":
+        drift = await check_drift()
+        for collection, report in drift.items():
+            print(f"{collection}: {report}")
+        print("no drift" if not drift else "")
+    elif command == "explain":
+        for name, collection, indexes in await explain_hot_queries():
+            print(f"{name:<20} {collection:<14} {', '.join(indexes)}")
+    elif command == "duplicates":
+        duplicates = await duplicate_transactions()
+        for key, value, ids in duplicates:
+            print(f"{key}={value}: {', '.join(ids)}")
+        print("no duplicates" if not duplicates else "")
+    else:
+        print(__doc__)
+
+
+if __name__ == "__main__":
+    asyncio.run(_main(sys.argv[1] if len(sys.argv) > 1 else ""))
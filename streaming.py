@@ -0,0 +1,60 @@
+from typing import Callable
+
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+
+from responses import dumps
+
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+JSON_MEDIA_TYPE = "application/json"
+
+# documents pulled from Mongo per getMore, and written to the socket per chunk
+STREAM_BATCH_SIZE = 500
+
+
+def wants_ndjson(request: Request) -> bool:
+    return NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+def wants_stream(request: Request, stream: bool = False) -> bool:
+    # NDJSON is only ever streamed, a JSON array is streamed on request
+    return stream or wants_ndjson(request)
+
+
+async def _json_array(cursor, encode: Callable[[dict], dict]):
+    yield b"["
+    first = True
+    chunk = []
+    async for doc in cursor:
+        chunk.append(dumps(encode(doc)))
+        if len(chunk) == STREAM_BATCH_SIZE:
+            yield (b"" if first else b",") + b",".join(chunk)
+            first = False
+            chunk = []
+    if chunk:
+        yield (b"" if first else b",") + b",".join(chunk)
+    yield b"]"
+
+
+async def _ndjson(cursor, encode: Callable[[dict], dict]):
+    chunk = []
+    async for doc in cursor:
+        chunk.append(dumps(encode(doc)) + b"\n")
+        if len(chunk) == STREAM_BATCH_SIZE:
+            yield b"".join(chunk)
+            chunk = []
+    if chunk:
+        yield b"".join(chunk)
+
+
+def stream_response(request: Request, cursor, encode: Callable[[dict], dict]) -> StreamingResponse:
+    """
+        stream a Motor cursor as NDJSON or a JSON array, picked from the Accept
+        header. at most one batch of documents is held in memory, and the next
+        batch isn't fetched until the previous chunk has been sent.
+    """
+    cursor = cursor.batch_size(STREAM_BATCH_SIZE)
+    if wants_ndjson(request):
+        return StreamingResponse(_ndjson(cursor, encode), media_type=NDJSON_MEDIA_TYPE)
+    return StreamingResponse(_json_array(cursor, encode), media_type=JSON_MEDIA_TYPE)
@@ -0,0 +1,51 @@
+import asyncio
+import os
+import stat
+from typing import Iterable, List
+
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache, select_autoescape
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMPLATES_DIR = os.path.join(BASE_DIR, "templates")
+# unset uses jinja's per-user directory, which it creates 0700 and checks the owner of
+TEMPLATES_CACHE_DIR = os.environ.get("TEMPLATES_CACHE_DIR")
+
+
+def bytecode_cache(directory: str = TEMPLATES_CACHE_DIR) -> FileSystemBytecodeCache:
+    if not directory:
+        return FileSystemBytecodeCache()
+
+    # cached bytecode is loaded and executed, so nobody else may be able to write it
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    info = os.lstat(directory)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise RuntimeError(f"TEMPLATES_CACHE_DIR {directory} must be a directory owned by this user and writable by no one else")
+    return FileSystemBytecodeCache(directory)
+
+
+# templates are resolved relative to this file, not the working directory, and
+# compiled bytecode is cached on disk so workers skip the jinja compile step
+TEMP_ENV = Environment(
+    loader=FileSystemLoader(TEMPLATES_DIR),
+    bytecode_cache=bytecode_cache(),
+    autoescape=select_autoescape(["html"]),
+    auto_reload=False,
+    enable_async=True,
+)
+
+
+def precompile_templates() -> List[str]:
+    names = TEMP_ENV.list_templates(extensions=["html"])
+    for name in names:
+        TEMP_ENV.get_template(name)
+    return names
+
+
+async def render_template(template_name: str, /, **context) -> str:
+    return await TEMP_ENV.get_template(template_name).render_async(**context)
+
+
+async def render_many(template_name: str, contexts: Iterable[dict]) -> List[str]:
+    template = TEMP_ENV.get_template(template_name)
+    return await asyncio.gather(*(template.render_async(**context) for context in contexts))
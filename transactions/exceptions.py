@@ -0,0 +1,17 @@
+from fastapi import HTTPException, status
+
+ingest_too_large_exception = HTTPException(
+    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+    detail="too many transactions in one request"
+)
+
+invalid_ingest_body_exception = HTTPException(
+    status_code=status.HTTP_400_BAD_REQUEST,
+    detail="send a JSON array of transactions or application/x-ndjson, one transaction per line"
+)
+
+idempotency_unavailable_exception = HTTPException(
+    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+    detail="transactions can't be stored until the unique transaction indexes exist, see `python -m schema duplicates`",
+    headers={"Retry-After": "60"},
+)
@@ -0,0 +1,225 @@
+"""
+    bulk transaction ingest for payment callbacks and reconciliation.
+
+    transactionid and trxn_referenceid are unique, so a provider retrying a
+    callback can't create a second record: the retry comes back as a
+    duplicate. items are validated and written in chunks of
+    TRANSACTION_INGEST_CHUNK with one unordered insert_many each, so a bad
+    or duplicate item doesn't stop the rest. an NDJSON body is read line by
+    line as it arrives and only one chunk of documents is held at a time.
+"""
+import os
+from typing import AsyncIterator, List, Tuple
+
+import orjson
+from fastapi import Request
+from pydantic import ValidationError
+from pymongo.errors import BulkWriteError
+
+from auth.models import UserModel
+from database import db as mongoDB
+from metrics import register_stats
+from streaming import NDJSON_MEDIA_TYPE
+from .exceptions import idempotency_unavailable_exception, ingest_too_large_exception, invalid_ingest_body_exception
+from .models import Transaction
+from .utils import send_invoice_mails
+
+
+TRANSACTION_INGEST_CHUNK = int(os.environ.get("TRANSACTION_INGEST_CHUNK", 500))
+TRANSACTION_INGEST_MAX_ITEMS = int(os.environ.get("TRANSACTION_INGEST_MAX_ITEMS", 10000))
+# a JSON array has to be parsed whole, NDJSON is only limited by the item count
+TRANSACTION_INGEST_MAX_BYTES = int(os.environ.get("TRANSACTION_INGEST_MAX_BYTES", 8 * 1024 * 1024))
+TRANSACTION_INGEST_MAX_LINE = 64 * 1024
+
+DUPLICATE_KEY = 11000
+
+CREATED, DUPLICATE, INVALID = "created", "duplicate", "invalid"
+
+# declared in schema.INDEXES; without them a retry would be stored again
+UNIQUE_INDEXES = {"transaction_id", "transaction_reference"}
+_unique_indexes_ready = False
+
+ingest_stats = {CREATED: 0, DUPLICATE: 0, INVALID: 0, "requests": 0, "write_concern_errors": 0, "invoice_errors": 0}
+
+register_stats("transaction_ingest", "Bulk transaction ingest outcomes.", lambda: ingest_stats)
+
+
+async def require_unique_indexes():
+    """
+        refuse to store transactions while the unique indexes are missing,
+        usually because duplicates already in the collection kept them from
+        building. once they are seen they are assumed to stay.
+    """
+    global _unique_indexes_ready
+    if _unique_indexes_ready:
+        return
+    if not UNIQUE_INDEXES <= set(await mongoDB["transactions"].index_information()):
+        raise idempotency_unavailable_exception
+    _unique_indexes_ready = True
+
+
+async def _ndjson_items(request: Request) -> AsyncIterator:
+    buffer = b""
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        if len(buffer) > TRANSACTION_INGEST_MAX_LINE:
+            raise invalid_ingest_body_exception
+        for line in lines:
+            if line.strip():
+                yield _parse(line)
+    if buffer.strip():
+        yield _parse(buffer)
+
+
+def _parse(line: bytes):
+    try:
+        return orjson.loads(line)
+    except orjson.JSONDecodeError as err:
+        # one broken line is reported as an invalid item, not a failed request
+        return err
+
+
+async def _array_items(request: Request) -> AsyncIterator:
+    length = request.headers.get("content-length", "")
+    if length.isdigit() and int(length) > TRANSACTION_INGEST_MAX_BYTES:
+        raise ingest_too_large_exception
+
+    chunks, received = [], 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > TRANSACTION_INGEST_MAX_BYTES:
+            raise ingest_too_large_exception
+        chunks.append(chunk)
+    body = b"".join(chunks)
+    del chunks
+    try:
+        items = orjson.loads(body)
+    except orjson.JSONDecodeError:
+        raise invalid_ingest_body_exception
+    del body
+
+    if not isinstance(items, list):
+        raise invalid_ingest_body_exception
+    if len(items) > TRANSACTION_INGEST_MAX_ITEMS:
+        raise ingest_too_large_exception
+    for item in items:
+        yield item
+
+
+def read_items(request: Request) -> AsyncIterator:
+    if request.headers.get("content-type", "").startswith(NDJSON_MEDIA_TYPE):
+        return _ndjson_items(request)
+    return _array_items(request)
+
+
+def _validate(item, user: UserModel) -> Tuple[dict, str]:
+    if isinstance(item, Exception):
+        return None, f"invalid JSON: {item}"
+    if not isinstance(item, dict):
+        return None, "expected a JSON object"
+    try:
+        tranx = Transaction.model_validate(item)
+    except ValidationError as err:
+        return None, "; ".join(f"{'.'.join(map(str, error['loc']))}: {error['msg']}" for error in err.errors())
+
+    tranx.id = None
+    tranx.userid = user.id
+    tranx.name = user.name
+    doc = tranx.model_dump(mode="json", exclude={"id"})
+    return doc, None
+
+
+async def _write_chunk(docs: List[dict], positions: List[int], results: list, write_concern_errors: list) -> List[dict]:
+    """
+        insert one chunk unordered and fill in each item's result. returns
+        the documents that were created. a write concern error means the
+        chunk's inserts may not be durable; they are reported as unconfirmed.
+    """
+    failed, concern = {}, []
+    try:
+        inserted = (await mongoDB["transactions"].insert_many(docs, ordered=False)).inserted_ids
+    except BulkWriteError as err:
+        failed = {error["index"]: error for error in err.details["writeErrors"]}
+        concern = err.details.get("writeConcernErrors") or []
+        inserted = [doc.get("_id") for doc in docs]
+
+    if concern:
+        ingest_stats["write_concern_errors"] += 1
+        write_concern_errors.append({
+            "first_index": positions[0],
+            "last_index": positions[-1],
+            "errors": [error.get("errmsg") for error in concern],
+        })
+
+    created = []
+    for index, (doc, position) in enumerate(zip(docs, positions)):
+        error = failed.get(index)
+        if error is None:
+            results[position] = {"index": position, "status": CREATED, "id": str(inserted[index]), "transactionid": doc["transactionid"]}
+            if concern:
+                results[position]["unconfirmed"] = True
+            created.append(doc)
+        elif error["code"] == DUPLICATE_KEY:
+            results[position] = {"index": position, "status": DUPLICATE, "transactionid": doc["transactionid"]}
+        else:
+            results[position] = {"index": position, "status": INVALID, "transactionid": doc["transactionid"], "error": error.get("errmsg")}
+    return created
+
+
+async def ingest(items: AsyncIterator, user: UserModel, send_invoices: bool = True) -> dict:
+    """
+        validate and store every item, returning a result per item in input
+        order plus totals and any write concern or invoice errors by chunk.
+        invoices are mailed for newly created transactions only, so a retried
+        callback doesn't mail twice; a chunk whose invoices couldn't be
+        queued is reported and its transactions stay stored. an NDJSON body past TRANSACTION_INGEST_MAX_ITEMS fails with the chunks
+        before it already stored; sending it again reports those as duplicates.
+    """
+    ingest_stats["requests"] += 1
+    results, write_concern_errors, invoice_errors = [], [], []
+    docs, positions = [], []
+
+    async def flush():
+        created = await _write_chunk(docs, positions, results, write_concern_errors)
+        if send_invoices and created:
+            try:
+                await send_invoice_mails(created, email=user.email)
+            except Exception as err:
+                # the chunk is stored, a retry would only see duplicates and never mail them
+                print(err, )
+                ingest_stats["invoice_errors"] += 1
+                invoice_errors.append({
+                    "first_index": positions[0],
+                    "last_index": positions[-1],
+                    "transactionids": [doc["transactionid"] for doc in created],
+                    "error": str(err),
+                })
+        docs.clear()
+        positions.clear()
+
+    async for item in items:
+        position = len(results)
+        if position >= TRANSACTION_INGEST_MAX_ITEMS:
+            raise ingest_too_large_exception
+        results.append(None)
+
+        doc, error = _validate(item, user)
+        if error:
+            results[position] = {"index": position, "status": INVALID, "error": error}
+            continue
+
+        docs.append(doc)
+        positions.append(position)
+        if len(docs) == TRANSACTION_INGEST_CHUNK:
+            await flush()
+
+    if docs:
+        await flush()
+
+    totals = {CREATED: 0, DUPLICATE: 0, INVALID: 0}
+    for result in results:
+        totals[result["status"]] += 1
+    for outcome, count in totals.items():
+        ingest_stats[outcome] += count
+    return {**totals, "write_concern_errors": write_concern_errors, "invoice_errors": invoice_errors, "results": results}
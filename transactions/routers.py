@@ -1,20 +1,25 @@
 from datetime import timedelta, datetime
 from typing import Annotated
 from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
 import os
 
-from fastapi import APIRouter, Depends, HTTPException, status, Query
-from fastapi.responses import JSONResponse, HTMLResponse, RedirectResponse
-from fastapi.encoders import jsonable_encoder
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request
+from fastapi.responses import HTMLResponse, RedirectResponse
 
 from jose import JWTError, jwt
 
 from auth.models import UserModel
 from auth.utils import filter_none_and_empty_fields, castObjectId
 from driver.dependencies import get_current_user_by_jwtoken, get_token_header
-from database import db as mongoDB
+from database import db as mongoDB, read_db
+from responses import ORJSONResponse
+from pagination import PageParams, paginate, page_cursor, page_response
+from streaming import wants_stream, stream_response
 
 from .models import Transaction
+from .utils import send_invoice_mails
+from .ingest import ingest, read_items, require_unique_indexes
 
 router = APIRouter(
     prefix="/api/transactions",
@@ -23,39 +28,68 @@ router = APIRouter(
     responses={404: {"description": "Not found"}},
 )
 
+readDB = read_db("transactions")
+
 
 @router.post("/create", response_description="create a transaction", response_model=Transaction)
 async def create_transaction(tranx: Transaction, current_user: Annotated[UserModel, Depends(get_current_user_by_jwtoken)]):
-    
+    await require_unique_indexes()
+
     try:
         tranx.userid = current_user.id
         tranx.name = current_user.name
         
-        tranx_enc = jsonable_encoder(tranx) 
+        tranx_enc = tranx.model_dump(mode="json")
         
         new_tranx = await mongoDB["transactions"].insert_one(tranx_enc)
 
         tranx.id = str(new_tranx.inserted_id)
-        
-        return JSONResponse(status_code=status.HTTP_201_CREATED, content=jsonable_encoder(tranx))
+    except DuplicateKeyError:
+        # a retried payment callback gets the stored transaction back instead of a second one,
+        # whichever of the two unique keys it clashed on
+        existing = await mongoDB["transactions"].find_one(
+            {"$or": [{"transactionid": tranx.transactionid}, {"trxn_referenceid": tranx.trxn_referenceid}]}
+        )
+        if existing is None or existing.get("userid") != current_user.id:
+            # gone since the insert failed, or someone else's transaction
+            return ORJSONResponse(status_code=status.HTTP_409_CONFLICT, content={"error": "a transaction with this transactionid or trxn_referenceid already exists"})
+        return ORJSONResponse(status_code=status.HTTP_200_OK, content=castObjectId(existing))
     except Exception as e:
         print(e, )  
-        return JSONResponse(status_code=status.HTTP_400_BAD_REQUEST, content={"error": "encountered error creating transaction"})
+        return ORJSONResponse(status_code=status.HTTP_400_BAD_REQUEST, content={"error": "encountered error creating transaction"})
+
+    try:
+        await send_invoice_mails([tranx_enc], email=current_user.email)
+    except Exception as e:
+        # the transaction is stored, a failed invoice doesn't undo it
+        print(e, )
+
+    return ORJSONResponse(status_code=status.HTTP_201_CREATED, content=tranx)
+
+
+@router.post("/bulk", response_description="store many transactions, skipping ones already stored")
+async def bulk_create_transactions(request: Request, current_user: Annotated[UserModel, Depends(get_current_user_by_jwtoken)],
+                                   send_invoices: bool = True):
+    await require_unique_indexes()
+    # the body is a JSON array or application/x-ndjson, read by ingest rather than a model so it can be streamed
+    report = await ingest(read_items(request), current_user, send_invoices)
+    return ORJSONResponse(status_code=status.HTTP_200_OK, content=report)
 
 
 @router.get("/{userId}/transactions", response_description="Fetch all a user's transactions", response_model=Transaction)
-async def fetch_transactions(userId: str, current_user: Annotated[UserModel, Depends(get_current_user_by_jwtoken)]):
+async def fetch_transactions(request: Request, userId: str, current_user: Annotated[UserModel, Depends(get_current_user_by_jwtoken)],
+                            page: Annotated[PageParams, Depends()], stream: bool = False):
+    if wants_stream(request, stream):
+        transactions_cursor = page_cursor(readDB["transactions"], {"userid": userId}, cursor=page.cursor, limit=0)
+        return stream_response(request, transactions_cursor, castObjectId)
+
     try:
-        transactions = []
-        
-        async for tranx in mongoDB["transactions"].find({"userid": userId}):
-            castObjectId(tranx)
-            transactions.append(tranx)
+        transactions, next_cursor = await paginate(readDB["transactions"], {"userid": userId}, cursor=page.cursor, limit=page.limit)
         
-        return JSONResponse(status_code=status.HTTP_200_OK, content=transactions)
+        return page_response([castObjectId(tranx) for tranx in transactions], next_cursor)
     except Exception as e:
         print(e, )
-        return JSONResponse(status_code=status.HTTP_400_BAD_REQUEST)
+        return ORJSONResponse(status_code=status.HTTP_400_BAD_REQUEST)
     
     
 @router.get("/{userId}/transactions/{transactionId}", response_description="Fetch a user transaction", response_model=Transaction)
@@ -65,6 +99,6 @@ async def fetch_transaction(userId: str, transactionId: str, current_user: Annot
     if transaction:
         castObjectId(transaction)
         
-        return JSONResponse(status_code=status.HTTP_200_OK, content=transaction)
-    return JSONResponse(status_code=status.HTTP_404_NOT_FOUND, content={"error": "transaction not found"})
+        return ORJSONResponse(status_code=status.HTTP_200_OK, content=transaction)
+    return ORJSONResponse(status_code=status.HTTP_404_NOT_FOUND, content={"error": "transaction not found"})
    
\ No newline at end of file
@@ -0,0 +1,35 @@
+from datetime import datetime
+from typing import List
+
+from auth.mailer import enqueue_mail
+from templating import render_many
+
+
+INVOICE_TEMPLATE = "invoice.html"
+
+
+def invoice_context(tranx: dict, email: str) -> dict:
+    timestamp = tranx.get("timestamp")
+    if isinstance(timestamp, str):
+        timestamp = datetime.fromisoformat(timestamp)
+
+    seats = tranx.get("seats") or 1
+    return {
+        "name": tranx.get("name"),
+        "email": email,
+        "reference": tranx.get("trxn_referenceid"),
+        "transaction_id": tranx.get("transactionid"),
+        "date": timestamp.strftime("%d/%m/%Y") if timestamp else "",
+        "description": tranx.get("message"),
+        "seats": seats,
+        "unit_price": tranx.get("amount", 0) / seats,
+        "amount": tranx.get("amount", 0),
+    }
+
+
+async def send_invoice_mails(transactions: List[dict], email: str):
+    # every invoice in the batch is rendered from the one compiled template
+    invoices = await render_many(INVOICE_TEMPLATE, (invoice_context(tranx, email) for tranx in transactions))
+
+    for tranx, invoice in zip(transactions, invoices):
+        await enqueue_mail(to=email, subject=f"Wenyfour invoice #{tranx.get('trxn_referenceid')}", body=invoice)